@@ -0,0 +1,74 @@
+# sqltail row formatting benchmark
+#
+# Compares the compiled row formatter against the original per-row path,
+# which looked up each Field by column name and built an arrow object for
+# every datetime.
+#
+#   python benchmarks/bench_format.py --rows 50000 --tz US/Eastern
+
+import arrow
+import click
+import datetime
+import json
+import time
+
+from sqltail.db import Row
+from sqltail.formatter import compile_formatter
+from sqltail.monitor import Field
+
+NAMES = ['id', 'timestamp', 'level', 'message']
+
+
+def make_rows(count):
+    start = datetime.datetime(2021, 1, 1)
+    return [
+        (i, i, start + datetime.timedelta(milliseconds=i * 37), 'INFO', f"message number {i} from the benchmark")
+        for i in range(count)
+    ]
+
+
+def legacy_format(fields, delimiter):
+    def fmt_datetime(field):
+        return lambda dt: arrow.get(dt).to(field.tz).isoformat(' ')[:24]
+    funcs = {name: fmt_datetime(f) if f.fmt == f.fmt_datetime else f.fmt for name, f in fields.items()}
+
+    def format_row(row):
+        return delimiter.join([funcs[k](v) for k, v in row.items() if k in funcs])
+    return format_row
+
+
+def measure(func, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            func(row)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(rows) / best
+
+
+@click.command()
+@click.option('--rows', default=50000, type=int)
+@click.option('--repeat', default=3, type=int)
+@click.option('--tz', default='UTC')
+def main(rows, repeat, tz):
+    fields = {name: Field(name, tz=tz) for name in NAMES}
+    tuples = make_rows(rows)
+    dicts = [Row(zip(['_id'] + NAMES, row)) for row in tuples]
+    funcs = [field.compile() for field in fields.values()]
+    legacy = legacy_format(fields, ' ')
+    compiled = compile_formatter(funcs, ' ', offset=1)
+    assert legacy(dicts[-1]) == compiled(tuples[-1])
+    result = dict(
+        rows=rows,
+        tz=tz,
+        legacy_rows_per_sec=round(measure(legacy, dicts, repeat)),
+        compiled_rows_per_sec=round(measure(compiled, tuples, repeat)),
+    )
+    result['speedup'] = round(result['compiled_rows_per_sec'] / result['legacy_rows_per_sec'], 2)
+    click.echo(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
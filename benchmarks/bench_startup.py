@@ -0,0 +1,66 @@
+# sqltail startup benchmark
+#
+# Times short-lived sqltail processes: importing the cli, and running
+# --get-template against a SQLite stand-in table with and without the
+# schema cache.  Each case runs in a fresh interpreter, as scripts start it.
+#
+#   python benchmarks/bench_startup.py --runs 20
+
+import click
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CLI = 'from sqltail.cli import sqltail; sqltail()'
+
+
+def make_database(path):
+    cxn = sqlite3.connect(path)
+    cxn.execute('CREATE TABLE log (id INTEGER PRIMARY KEY, timestamp DATETIME, level TEXT, message TEXT);')
+    cxn.execute("INSERT INTO log (timestamp, level, message) VALUES ('2021-01-01 00:00:00.000001', 'INFO', 'benchmark');")
+    cxn.commit()
+    cxn.close()
+
+
+def measure(args, runs):
+    """return the wall clock seconds of each run of python with args"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summary(times):
+    return dict(min_ms=round(min(times) * 1000, 1), median_ms=round(statistics.median(times) * 1000, 1))
+
+
+@click.command()
+@click.option('--runs', default=10, type=int)
+def main(runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        make_database(database)
+        cache = os.path.join(tmp, 'schema.json')
+        template = ['-c', CLI, '--backend', 'sqlite', '--database', database, '--get-template']
+        cases = dict(
+            python=['-c', 'pass'],
+            import_cli=['-c', 'import sqltail.cli'],
+            get_template=template,
+            get_template_cached=template + ['--schema-cache', cache],
+        )
+        # fill the cache before timing
+        measure(cases['get_template_cached'], 1)
+        result = dict(runs=runs)
+        result.update({name: summary(measure(args, runs)) for name, args in cases.items()})
+    click.echo(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
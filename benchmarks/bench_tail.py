@@ -0,0 +1,188 @@
+# sqltail tail loop benchmark
+#
+# Drives SQLTail against a throwaway SQLite database while a separate
+# process inserts rows at a fixed rate, and reports throughput, insert to
+# output latency percentiles, queries per output row and peak RSS.
+# --backlog also inserts rows before the tail starts, resuming from a
+# checkpoint at id 0, to measure catch-up.  Results are printed as json and
+# may be saved with --output; --baseline compares them to a saved run and
+# fails if throughput or latency regress by more than --tolerance.
+#
+#   python benchmarks/bench_tail.py --rate 5000 --duration 5 --output bench.json
+#   python benchmarks/bench_tail.py --rate 5000 --duration 5 --baseline bench.json
+
+import click
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from sqltail.checkpoint import Checkpoint
+from sqltail.db import SQLiteDatabase
+from sqltail.monitor import SQLTail
+
+TICK=0.01
+
+
+def create_table(path):
+    cxn = sqlite3.connect(path)
+    cxn.execute('PRAGMA journal_mode=WAL;')
+    cxn.execute('CREATE TABLE log (id INTEGER PRIMARY KEY, timestamp DATETIME, level TEXT, message TEXT);')
+    cxn.commit()
+    cxn.close()
+
+
+def insert_rows(path, count):
+    """insert count rows in one transaction; each message is the insert time"""
+    cxn = sqlite3.connect(path, isolation_level=None)
+    with cxn:
+        now = time.time()
+        stamp = utc_stamp(now)
+        cxn.executemany('INSERT INTO log (timestamp, level, message) VALUES (?, ?, ?);', [(stamp, 'INFO', repr(now))] * count)
+    cxn.close()
+
+
+def generate(path, rate, duration):
+    """insert rows at rate per second for duration seconds, committing every tick"""
+    cxn = sqlite3.connect(path, isolation_level=None)
+    start = time.time()
+    inserted = 0
+    while True:
+        now = time.time()
+        if now - start >= duration:
+            break
+        due = int((now - start) * rate) - inserted
+        if due > 0:
+            stamp = utc_stamp(now)
+            with cxn:
+                cxn.executemany('INSERT INTO log (timestamp, level, message) VALUES (?, ?, ?);', [(stamp, 'INFO', repr(now))] * due)
+            inserted += due
+        time.sleep(TICK)
+    cxn.close()
+
+
+def insert_time(output_format):
+    """return a function reading the insert time from the message column, last in each record"""
+    if output_format == 'ndjson':
+        return lambda msg: float(json.loads(msg)['message'])
+    delimiter = ',' if output_format == 'csv' else ' '
+    return lambda msg: float(msg.rsplit(delimiter, 1)[1])
+
+
+def utc_stamp(now):
+    return datetime.datetime.fromtimestamp(now, datetime.timezone.utc).replace(tzinfo=None).isoformat(' ')
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+
+PARAMETERS = ['rate', 'duration', 'backlog', 'scheduler', 'batch_size', 'probe', 'output_format']
+
+
+def compare(result, baseline, tolerance):
+    """return a description of each measure of result worse than baseline by more than tolerance"""
+    different = [name for name in PARAMETERS if result.get(name) != baseline.get(name)]
+    if different:
+        raise click.ClickException(f"baseline was run with different {', '.join(different)}")
+    regressions = []
+    checks = [('rows_per_sec', 1), ('latency_p50_ms', -1), ('latency_p99_ms', -1), ('queries_per_row', -1)]
+    for name, direction in checks:
+        old, new = baseline.get(name), result.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * direction
+        if change < -tolerance:
+            regressions.append(f"{name} {old} -> {new}")
+    return regressions
+
+
+@click.command()
+@click.option('--rate', default=2000, type=int, help='rows inserted per second')
+@click.option('--duration', default=5, type=float, help='seconds of inserts')
+@click.option('--backlog', default=0, type=int, help='rows inserted before the tail starts')
+@click.option('--scheduler', default='adaptive', type=click.Choice(['backoff', 'adaptive']))
+@click.option('--interval', default=1, type=float)
+@click.option('--min-interval', default=0.1, type=float)
+@click.option('--batch-size', default=1000, type=int)
+@click.option('--probe', default=None, type=click.Choice(['max_id', 'auto_increment']))
+@click.option('--output-format', default='text', type=click.Choice(['text', 'ndjson', 'csv']))
+@click.option('--output', default=None, type=click.Path(), help='save the result json to this file')
+@click.option('--baseline', default=None, type=click.Path(exists=True), help='fail on regression against this saved result')
+@click.option('--tolerance', default=0.3, type=float, help='allowed fractional regression against the baseline')
+def main(rate, duration, backlog, scheduler, interval, min_interval, batch_size, probe, output_format, output, baseline, tolerance):
+    latencies = []
+    inserted = insert_time(output_format)
+
+    def callback(msg):
+        latencies.append(time.time() - inserted(msg))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        create_table(path)
+        checkpoint = None
+        if backlog:
+            insert_rows(path, backlog)
+            checkpoint = os.path.join(tmp, 'checkpoint.json')
+        db = SQLiteDatabase(database=path)
+        tail = SQLTail(
+            db, fields=['id', 'timestamp', 'level', 'message'], callbacks=[callback], output_format=output_format,
+            scheduler=scheduler, interval=interval, min_interval=min_interval, batch_size=batch_size, probe=probe,
+            checkpoint=checkpoint, checkpoint_interval=60
+        )
+        if checkpoint:
+            Checkpoint(checkpoint, tail.checkpoint.key, 0).update(0)
+        generator = multiprocessing.Process(target=generate, args=(path, rate, duration))
+        generator.start()
+        start = time.perf_counter()
+        tail.run(timeout=duration)
+        elapsed = time.perf_counter() - start
+        generator.join()
+        stats = tail.get_stats()
+
+    latencies.sort()
+    rows = len(latencies)
+    execute = stats['db']['stages'].get('execute', {})
+    result = dict(
+        rate=rate,
+        duration=duration,
+        backlog=backlog,
+        scheduler=scheduler,
+        batch_size=batch_size,
+        probe=probe,
+        output_format=output_format,
+        python=sys.version.split()[0],
+        rows=rows,
+        elapsed=round(elapsed, 3),
+        rows_per_sec=round(rows / elapsed, 1),
+        latency_p50_ms=round(percentile(latencies, 50) * 1000, 2) if rows else None,
+        latency_p90_ms=round(percentile(latencies, 90) * 1000, 2) if rows else None,
+        latency_p99_ms=round(percentile(latencies, 99) * 1000, 2) if rows else None,
+        latency_mean_ms=round(statistics.mean(latencies) * 1000, 2) if rows else None,
+        polls=stats['tail'].get('polls', 0),
+        queries=stats['db'].get('queries', 0),
+        queries_per_row=round(stats['db'].get('queries', 0) / rows, 4) if rows else None,
+        execute_p50_ms=round(execute['p50'] * 1000, 3) if execute else None,
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    )
+    text = json.dumps(result, indent=2)
+    click.echo(text)
+    if output:
+        with open(output, 'w') as ofp:
+            ofp.write(text + '\n')
+    if baseline:
+        with open(baseline) as ifp:
+            regressions = compare(result, json.load(ifp), tolerance)
+        if regressions:
+            raise click.ClickException(f"regression against {baseline}: {'; '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
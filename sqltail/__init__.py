@@ -1,7 +1,45 @@
 # sqltail
 
-from sqltail.monitor import SQLTail
-from sqltail.db import Database, DatabaseException, DatabaseConnectionFailed, DatabaseNotFound
+import importlib
+
+# names exported by the package, imported from their modules on first use so
+# a short-lived sqltail only pays for the parts it runs (asyncio, http.server,
+# the database drivers)
+_EXPORTS = {
+    'sqltail.monitor': ['SQLTail'],
+    'sqltail.multi': ['MultiTail'],
+    'sqltail.aio': ['AsyncSQLTail'],
+    'sqltail.pipeline': ['Pipeline'],
+    'sqltail.server': ['TailServer'],
+    'sqltail.binlog': ['BinlogTail'],
+    'sqltail.catchup': ['CatchUp'],
+    'sqltail.checkpoint': ['Checkpoint'],
+    'sqltail.schema': ['SchemaCache'],
+    'sqltail.filters': ['Filter', 'FilterError'],
+    'sqltail.window': ['TimeWindow', 'parse_time'],
+    'sqltail.output': ['BatchWriter', 'make_encoder'],
+    'sqltail.stats': ['Stats', 'StatsReporter'],
+    'sqltail.metrics': ['MetricsServer', 'render_metrics'],
+    'sqltail.db': ['Database', 'PostgresDatabase', 'SQLiteDatabase', 'make_database', 'Backoff', 'DatabaseException', 'DatabaseConnectionFailed', 'DatabaseNotFound'],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_MODULES)
 
 __version__='1.0.3'
 __license__='Copyright 2021 Reliance Systems, Inc. - MIT license - https://github.com/rstms/sqltail'
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        value = getattr(importlib.import_module(_MODULES[name]), name)
+    elif f"sqltail.{name}" in _EXPORTS or name in ('formatter', 'scheduler', 'cli'):
+        value = importlib.import_module(f"sqltail.{name}")
+    else:
+        raise AttributeError(f"module 'sqltail' has no attribute '{name}'")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,116 @@
+# sqltail asyncio
+
+import asyncio
+import inspect
+import logging
+import time
+
+QUEUE_SIZE=1000
+
+
+class AsyncSQLTail():
+    """
+    Run a SQLTail on an asyncio event loop.
+
+    The blocking database calls of the wrapped SQLTail run in an executor
+    (the loop's default thread pool unless one is given), one batch at a
+    time, while the poll interval is awaited instead of slept.  Formatted
+    rows pass to the callbacks through a bounded queue; callbacks may be
+    plain functions or coroutine functions, and when they fall behind the
+    queue fills and the poller stops fetching until they catch up.
+
+    Example:
+
+        tail = AsyncSQLTail(SQLTail(db, table='log'), callbacks=[send])
+        await tail.run()
+    """
+
+    def __init__(self, tail, callbacks=None, executor=None, queue_size=QUEUE_SIZE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tail = tail
+        self.callbacks = tail.callbacks if callbacks is None else callbacks
+        self.executor = executor
+        self.queue_size = queue_size
+        self.running = False
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.tail}>"
+
+    def fetch(self):
+        """poll the tail in the executor, returning (id, message) pairs instead of calling callbacks"""
+        rows = []
+        self.tail.poll(lambda row: rows.append((row[0], self.tail.encode(row))))
+        return rows
+
+    async def run(self, timeout=None):
+        self.logger.debug('run: begin')
+        loop = asyncio.get_event_loop()
+        deadline = time.monotonic() + timeout if timeout else None
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        await loop.run_in_executor(self.executor, self.tail.start)
+        self.running = True
+        consumer = asyncio.ensure_future(self.consume(queue))
+        try:
+            if self.tail.catchup_workers:
+                await loop.run_in_executor(self.executor, self.catch_up, loop, queue, consumer)
+            # the tail stops itself at the end of a time window
+            while self.running and self.tail.running and not consumer.done():
+                rows = await loop.run_in_executor(self.executor, self.fetch)
+                for row in rows:
+                    await self.put(queue, consumer, row)
+                wait = self.tail.next_wait(len(rows))
+                if not rows and deadline and time.monotonic() > deadline:
+                    self.logger.debug('Timeout')
+                    break
+                if wait:
+                    await asyncio.sleep(wait)
+            if not consumer.done():
+                await self.put(queue, consumer, None)
+            await consumer
+        finally:
+            self.running = False
+            if not consumer.done():
+                consumer.cancel()
+            await loop.run_in_executor(self.executor, self.tail.stop)
+        self.logger.debug('run: end')
+
+    def catch_up(self, loop, queue, consumer):
+        """run the tail's parallel catch-up in the executor, queueing its rows for the callbacks"""
+        tail = self.tail
+
+        def output_row(row):
+            # waits for room in the queue, so the catch-up is held back like the poller
+            asyncio.run_coroutine_threadsafe(self.put(queue, consumer, (row[0], tail.encode(row))), loop).result()
+
+        tail.output_row = output_row
+        try:
+            return tail.catch_up()
+        finally:
+            del tail.output_row
+
+    async def put(self, queue, consumer, item):
+        """queue item, waiting for room; raises the consumer's exception if it fails while we wait"""
+        if not queue.full():
+            queue.put_nowait(item)
+            return
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait([put, consumer], return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            await consumer
+
+    def stop(self):
+        self.running = False
+
+    async def consume(self, queue):
+        while True:
+            row = await queue.get()
+            if row is None:
+                break
+            row_id, msg = row
+            for callback in self.callbacks:
+                result = callback(msg)
+                if inspect.isawaitable(result):
+                    await result
+            if self.tail.checkpoint:
+                self.tail.checkpoint.update(row_id)
@@ -0,0 +1,117 @@
+# sqltail binlog
+
+import logging
+import time
+
+from sqltail.db import DatabaseException
+
+SERVER_ID=4179
+HEARTBEAT=1
+EVENTS=('insert',)
+
+
+class BinlogTail():
+    """
+    Follow tables through the MySQL row-based replication stream instead of polling.
+
+    Rows are pushed to each SQLTail's formatting and callbacks as their
+    transactions are written to the binlog, starting from the server's
+    current position.  Inserts are output exactly like polled rows;
+    updates and deletes may also be requested with events, and are output
+    prefixed with the event name.
+
+    The server must run with binlog_format=ROW and binlog_row_image=FULL,
+    the user needs the REPLICATION SLAVE and REPLICATION CLIENT privileges,
+    and server_id must be unique among the server's replicas.  SQL filters
+    can not be evaluated against the stream and are ignored.
+
+    Requires the optional mysql-replication package (pip install sqltail[binlog]).
+    """
+
+    def __init__(self, tails, events=EVENTS, server_id=SERVER_ID, heartbeat=HEARTBEAT):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tails = {tail.table: tail for tail in tails}
+        self.db = tails[0].db
+        self.events = set(events)
+        unknown = self.events - {'insert', 'update', 'delete'}
+        if unknown:
+            raise ValueError(f"unknown binlog events: {', '.join(sorted(unknown))}")
+        self.server_id = server_id
+        self.heartbeat = heartbeat
+        self.running = False
+        for tail in tails:
+            # includes the where_clause of each field, which filters alone would miss
+            if tail.where_clauses:
+                self.logger.warning(f"{tail.table}: SQL filters are not applied in binlog mode")
+            if self.events != {'insert'}:
+                tail.init_encoder(events=True)
+        self.logger.debug(f"{self}")
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.db} {list(self.tails)} {sorted(self.events)}>"
+
+    def stream(self):
+        try:
+            from pymysqlreplication import BinLogStreamReader
+            from pymysqlreplication.event import HeartbeatLogEvent
+            from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+        except ImportError as exc:
+            raise DatabaseException('binlog mode requires the mysql-replication package') from exc
+        event_types = {'insert': WriteRowsEvent, 'update': UpdateRowsEvent, 'delete': DeleteRowsEvent}
+        # heartbeats wake the blocking reader so timeout and stop() are noticed on an idle server
+        only_events = [event_types[e] for e in self.events] + [HeartbeatLogEvent]
+        return BinLogStreamReader(
+            connection_settings=dict(host=self.db.server[0], port=int(self.db.server[1]), user=self.db.user, passwd=self.db.password),
+            server_id=self.server_id,
+            only_events=only_events,
+            only_schemas=[self.db.database],
+            only_tables=list(self.tails),
+            resume_stream=True,
+            blocking=True,
+            slave_heartbeat=self.heartbeat
+        )
+
+    def run(self, timeout=None):
+        self.logger.debug('run: begin')
+        deadline = time.monotonic() + timeout if timeout else None
+        self.running = True
+        stream = self.stream()
+        try:
+            for event in stream:
+                tail = self.tails.get(getattr(event, 'table', None))
+                if tail:
+                    self.handle_event(tail, event)
+                elif deadline and time.monotonic() > deadline:
+                    self.logger.debug('Timeout')
+                    break
+                if not self.running:
+                    break
+        finally:
+            self.running = False
+            stream.close()
+            for tail in self.tails.values():
+                if tail.checkpoint:
+                    tail.checkpoint.close()
+        self.logger.debug('run: end')
+
+    def stop(self):
+        self.running = False
+
+    def handle_event(self, tail, event):
+        kind = {'WriteRowsEvent': 'insert', 'UpdateRowsEvent': 'update', 'DeleteRowsEvent': 'delete'}[type(event).__name__]
+        names = tail.row_names
+        for values in event.rows:
+            values = values['after_values'] if kind == 'update' else values['values']
+            row = (values.get('id'),) + tuple(values.get(name) for name in names)
+            if tail.predicate and not tail.predicate(row):
+                continue
+            if kind == 'insert':
+                tail.output_row(row)
+            else:
+                # updates and deletes touch old rows, so they must not move the checkpoint
+                msg = tail.encode(row, kind)
+                for callback in tail.callbacks:
+                    callback(msg)
+                for callback in tail.batch_callbacks:
+                    callback([msg])
+        tail.flush()
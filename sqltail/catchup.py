@@ -0,0 +1,119 @@
+# sqltail catch-up
+
+import logging
+import threading
+import time
+
+CATCHUP_WORKERS=4
+CATCHUP_CHUNK=10000
+CATCHUP_BUFFER=8
+
+
+class CatchUp():
+    """
+    Read a large backlog of a tail in parallel.
+
+    The ids from the tail's last_id to the current end of the table (or of
+    its time window) are split into ranges of chunk_size ids, fetched by
+    `workers` threads each with its own connection cloned from the tail's.
+    Fetched ranges wait in a reorder buffer and are output through the
+    tail in id order, so the callbacks and checkpoint see exactly what the
+    live loop would have produced.  Workers run at most buffer ranges ahead
+    of the output, which bounds memory to about buffer * chunk_size rows.
+    """
+
+    def __init__(self, tail, workers=CATCHUP_WORKERS, chunk_size=CATCHUP_CHUNK, buffer=CATCHUP_BUFFER):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tail = tail
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.buffer = max(self.workers, buffer)
+        param = tail.db.param
+        self.sql_range = f"SELECT id as _id,{tail.sql_fields} FROM {tail.table} {tail.sql_where(f'id > {param} AND id <= {param}')} ORDER BY id;"
+        self.lock = threading.Condition()
+        self.slots = threading.Semaphore(self.buffer)
+        self.ranges = []
+        self.next_range = 0
+        self.results = {}
+        self.errors = []
+        self.running = False
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.tail.table} {self.workers} {self.chunk_size} {self.buffer}>"
+
+    def split(self, low, high):
+        """return the (low, high] id ranges covering low to high"""
+        return [(start, min(start + self.chunk_size, high)) for start in range(low, high, self.chunk_size)]
+
+    def run(self):
+        """output the rows up to the current end of the table, returning their count"""
+        tail = self.tail
+        high = tail.get_last_row_id() if tail.end_id is None else tail.end_id
+        if high - tail.last_id <= self.chunk_size:
+            # a single query in the live loop reads this much
+            return 0
+        self.ranges = self.split(tail.last_id, high)
+        self.logger.info(f"{tail.table}: catching up {high - tail.last_id} ids from {tail.last_id} in {len(self.ranges)} ranges")
+        start = time.perf_counter()
+        self.running = True
+        pool = [tail.db.clone() for _ in range(min(self.workers, len(self.ranges)))]
+        threads = [threading.Thread(target=self.run_worker, args=(db,), daemon=True) for db in pool]
+        for thread in threads:
+            thread.start()
+        count = 0
+        try:
+            for i in range(len(self.ranges)):
+                rows = self.take(i)
+                tail.output_rows(rows)
+                tail.flush()
+                self.slots.release()
+                count += len(rows)
+                # the range is complete even if its last ids were deleted or filtered out
+                tail.last_id = self.ranges[i][1]
+        finally:
+            self.running = False
+            with self.lock:
+                self.lock.notify_all()
+            for _ in threads:
+                self.slots.release()
+            for thread in threads:
+                thread.join()
+            for db in pool:
+                db.close()
+        tail.probe_id = max(tail.probe_id or 0, tail.last_id)
+        tail.newest_id = max(tail.newest_id or 0, high)
+        tail.stats.count('rows', count)
+        tail.stats.count('catchup_rows', count)
+        tail.stats.observe('catchup', time.perf_counter() - start)
+        self.logger.info(f"{tail.table}: caught up {count} rows to id {tail.last_id} in {time.perf_counter() - start:.3f}s")
+        return count
+
+    def take(self, i):
+        """wait for and remove the fetched rows of range i"""
+        with self.lock:
+            while i not in self.results:
+                if self.errors:
+                    raise self.errors[0]
+                self.lock.wait()
+            return self.results.pop(i)
+
+    def run_worker(self, db):
+        """fetch ranges in turn, at most buffer ranges ahead of the output"""
+        try:
+            with db.cursor(tuple=True) as cursor:
+                while True:
+                    self.slots.acquire()
+                    with self.lock:
+                        if not self.running or self.next_range >= len(self.ranges):
+                            return
+                        i = self.next_range
+                        self.next_range += 1
+                    rows = cursor.query(self.sql_range, self.ranges[i])
+                    with self.lock:
+                        self.results[i] = rows
+                        self.lock.notify_all()
+        except Exception as exc:
+            self.logger.error(f"worker failed: {exc}")
+            with self.lock:
+                self.errors.append(exc)
+                self.lock.notify_all()
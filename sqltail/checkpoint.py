@@ -0,0 +1,111 @@
+# sqltail checkpoint
+
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+CHECKPOINT_INTERVAL=1
+
+# serializes read-modify-write of checkpoint files shared by tails in one process
+_lock = threading.Lock()
+
+
+def write_json(path, data):
+    """
+    Replace the json file at path with data.  The new content goes to a
+    temporary file which is fsynced and renamed over the original, so a
+    crash leaves either the old or the new file, never a partial one.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, 'w') as ofp:
+            json.dump(data, ofp, indent=2, default=str)
+            ofp.flush()
+            os.fsync(ofp.fileno())
+        os.replace(tmp, str(path))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    fsync_dir(path.parent)
+
+
+def fsync_dir(path):
+    """make a rename in the directory at path durable"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Checkpoint():
+    """
+    Persist the id of the last row output by a tail, so a restarted tail
+    resumes where the previous one stopped instead of skipping or replaying rows.
+
+    The checkpoint file is a json object mapping tail keys to row ids, so
+    several tails may share one file, replaced atomically by write_json().
+    update() is cheap; the file is written at most once per interval
+    seconds, and on close().
+    """
+
+    def __init__(self, path, key, interval=CHECKPOINT_INTERVAL):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = pathlib.Path(path).expanduser()
+        self.key = key
+        self.interval = interval
+        self.last_id = None
+        self.saved_id = None
+        self.saved_at = 0
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.path} {self.key} {self.last_id}>"
+
+    @staticmethod
+    def make_key(host, port, database, table, filters=[]):
+        key = f"{host}:{port}/{database}/{table}"
+        if filters:
+            key += '?' + ' AND '.join(filters)
+        return key
+
+    def read(self):
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def load(self):
+        """return the stored row id for this key, or None"""
+        with _lock:
+            self.last_id = self.saved_id = self.read().get(self.key)
+        self.logger.debug(f"{self} loaded")
+        return self.last_id
+
+    def update(self, last_id):
+        self.last_id = last_id
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.save()
+
+    def save(self):
+        self.saved_at = time.monotonic()
+        if self.last_id is None or self.last_id == self.saved_id:
+            return
+        with _lock:
+            data = self.read()
+            data[self.key] = self.last_id
+            write_json(self.path, data)
+        self.saved_id = self.last_id
+        self.logger.debug(f"{self} saved")
+
+    def close(self):
+        self.save()
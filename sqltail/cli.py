@@ -1,88 +1,237 @@
 # cli
 
-import arrow
 import click
 import json
 import logging
 import time
 from pathlib import Path
 
-from sqltail import SQLTail, Database, DatabaseNotFound, DatabaseConnectionFailed, __version__, __license__
+from sqltail import SQLTail, MultiTail, BatchWriter, StatsReporter, Filter, FilterError, parse_time, make_database, Backoff, DatabaseNotFound, DatabaseConnectionFailed, __version__, __license__
 
 @click.command(name='sqltail')
 @click.version_option(message=f"sqltail v{__version__} {__license__}")
-@click.option('--host', envvar='DB_HOST', type=str)
+@click.option('--backend', envvar='DB_BACKEND', default='mysql', type=click.Choice(['mysql', 'postgresql', 'sqlite']), help='database server type; for sqlite, --database is the file path')
+@click.option('--host', envvar='DB_HOST', type=str, help='server, or comma separated servers tried in turn, as HOST or HOST:PORT')
 @click.option('--port', envvar='DB_PORT', type=str)
 @click.option('--user', envvar='DB_USER', type=str)
 @click.option('--password', envvar='DB_PASSWORD', type=str)
 @click.option('--database', envvar='DB_DATABASE', type=str)
 @click.option('--config-file', default=None)
 @click.option('--timeout', default=None, type=float)
-@click.option('--interval', default=1, type=int)
+@click.option('--interval', default=1, type=float, help='maximum seconds between polls')
+@click.option('--min-interval', default=0.1, type=float, help='minimum seconds between polls')
+@click.option('--backoff', default=2, type=float, help='wait multiplier applied after each empty poll')
+@click.option('--jitter', default=0.1, type=float, help='randomize each wait by up to this fraction')
+@click.option('--scheduler', default='adaptive', type=click.Choice(['backoff', 'adaptive']), help='poll scheduling: fixed backoff, or adapt to the insert rate')
 @click.option('--timezone', envvar='TZ', default='UTC')
-@click.option('--template', type=str, default=None, help='json field template, or @FILENAME in cwd or ~/.sqltail')
+@click.option('--template', type=str, default=None, help='json field template, or @FILENAME in cwd or ~/.sqltail; a json object maps table names to templates')
 @click.option('--get-template', is_flag=True, help='output json field template')
 @click.option('--get-columns', is_flag=True)
 @click.option('--suffix', type=str, default='_log', help="append SUFFIX to db name (defaults to _log)")
 @click.option('-r/-R', '--retry/--no-retry', is_flag=True, default=True, help="retry on database connection failures")
-@click.option('-t', '--table', default='log', type=str, help='table name')
+@click.option('--retry-timeout', default=None, type=float, help="give up reconnecting after this many seconds (default: retry indefinitely)")
+@click.option('--persistent/--no-persistent', is_flag=True, default=True, help="keep one connection open instead of reconnecting every poll")
+@click.option('--ping-interval', default=30, type=float, help="ping the server after this many idle seconds")
+@click.option('--batch-size', default=1000, type=int, help="maximum rows fetched per query (0 for unlimited)")
+@click.option('--checkpoint', type=str, default=None, help="resume from and record the last output row id in this file")
+@click.option('--checkpoint-interval', default=1, type=float, help="seconds between checkpoint writes")
+@click.option('--catchup-workers', default=0, type=int, help="connections reading a large backlog in parallel before tailing (0 to disable)")
+@click.option('--catchup-chunk', default=10000, type=int, help="ids per parallel catch-up query")
+@click.option('--processes', default=0, type=int, help="format and encode rows in this many processes (0 to format in the tail's thread)")
+@click.option('--schema-cache', envvar='SQLTAIL_SCHEMA_CACHE', type=str, default=None, help="keep table columns in this file to skip introspection at startup")
+@click.option('--schema-ttl', default=3600, type=float, help="seconds cached columns are trusted where the server has no schema version")
+@click.option('--since', default=None, type=str, help="start with the rows from this time, a duration ago (15m, 2h, 1d) or ISO 8601 in --timezone, then follow")
+@click.option('--until', default=None, type=str, help="stop after the rows before this time, a duration ago or ISO 8601 in --timezone")
+@click.option('--time-column', default=None, type=str, help="datetime column resolving --since and --until (default timestamp, created, or the first datetime column)")
+@click.option('--binlog', is_flag=True, help="follow the replication stream instead of polling (requires mysql-replication)")
+@click.option('--binlog-events', default='insert', type=str, help="comma delimited binlog events to output: insert,update,delete")
+@click.option('--server-id', default=4179, type=int, help="unique replica server id used in binlog mode")
+@click.option('--probe', default='auto', type=click.Choice(['auto', 'none', 'max_id', 'auto_increment']), help="cheap change check run before the tail query (auto: max_id when filtered)")
+@click.option('--flush-latency', default=0.1, type=float, help="maximum seconds rows are buffered before output")
+@click.option('--stats', 'stats_file', type=str, default=None, help="periodically write tail stats as json lines to FILE, or stderr for -")
+@click.option('--stats-interval', default=10, type=float, help="seconds between stats reports")
+@click.option('--metrics-port', default=None, type=int, help="serve prometheus metrics on this port")
+@click.option('--metrics-host', default='127.0.0.1', type=str, help="address for the metrics listener")
+@click.option('--serve', default=None, type=str, help="poll once for many clients, serving rows on this unix socket path or HOST:PORT")
+@click.option('--attach', default=None, type=str, help="output rows from the sqltail --serve at this unix socket path or HOST:PORT instead of the database")
+@click.option('-m', '--match', multiple=True, type=str, help="with --attach, output only rows with FIELD=VALUE; may be repeated")
+@click.option('-t', '--table', multiple=True, type=str, help='table name (defaults to log); may be repeated')
+@click.option('--workers', default=1, type=int, help='database connections shared by multiple tables')
 @click.option('-c', '--columns', default=None, type=str, help='comma delimited list of output column names')
 @click.option('-f', '--filters', default=None, type=str, help='list of filter conditions') 
-@click.option('-o', '--output-format', default='json', type=str, help='output format') 
+@click.option('-w', '--where', default=None, type=str, help="filter rows in sqltail with an expression, e.g. \"level == 'ERROR' and message ~ 'timeout'\"")
+@click.option('-o', '--output-format', default=None, type=click.Choice(['text', 'json', 'ndjson', 'csv', 'msgpack']), help='row output format (default text); json is ndjson for rows') 
 @click.option('-l', '--log-level', envvar="LOG_LEVEL", default='WARNING', type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], case_sensitive=False))
 
-def sqltail(host, port, user, password, database, config_file, timeout, interval, timezone, columns, filters, log_level, get_template, get_columns, table, template, output_format, suffix, retry):
+def sqltail(backend, host, port, user, password, database, config_file, timeout, interval, min_interval, backoff, jitter, scheduler, timezone, columns, filters, log_level, get_template, get_columns, table, template, output_format, suffix, retry, retry_timeout, persistent, ping_interval, batch_size, checkpoint, checkpoint_interval, catchup_workers, catchup_chunk, processes, schema_cache, schema_ttl, workers, binlog, binlog_events, server_id, probe, flush_latency, stats_file, stats_interval, metrics_port, metrics_host, serve, attach, match, where, since, until, time_column):
 
     logging.basicConfig(level=log_level.upper())
 
+    if where:
+        try:
+            Filter(where)
+        except FilterError as exc:
+            raise click.BadParameter(str(exc), param_hint='--where')
+    window = {}
+    for name, value in (('since', since), ('until', until)):
+        if value:
+            try:
+                # validated here; SQLTail parses it in --timezone when the window is resolved
+                parse_time(value, timezone)
+                window[name] = value
+            except ValueError as exc:
+                raise click.BadParameter(str(exc), param_hint=f"--{name}")
+            if binlog or serve or attach:
+                raise click.BadParameter('a time window is read by polling the database', param_hint=f"--{name}")
+
+    if attach:
+        return attach_server(attach, table, columns, template, match, where, timezone, output_format, timeout)
+    if match:
+        raise click.BadParameter('--match applies to --attach; use --where', param_hint='--match')
+    if serve and (binlog or processes):
+        raise click.BadParameter('the server tails by polling in one process', param_hint='--serve')
+
+    if binlog and backend != 'mysql':
+        raise click.BadParameter('binlog mode requires the mysql backend', param_hint='--binlog')
+    if processes and (binlog or len(table) > 1):
+        raise click.BadParameter('the process pipeline tails a single table by polling', param_hint='--processes')
+
+    if not retry:
+        retry_timeout = 0
+    deadline = None if retry_timeout is None else time.monotonic() + retry_timeout
+    connect_backoff = Backoff()
     state = None
     while True:
         try:
-            db=Database(host, port, user, password, database, config_file=config_file, debug=log_level=='DEBUG', suffix=suffix)
-        except DatabaseNotFound as exc:
+            db=make_database(backend, host=host, port=port, user=user, password=password, database=database, config_file=config_file, debug=log_level=='DEBUG', suffix=suffix, retry_timeout=retry_timeout)
+        except (DatabaseNotFound, DatabaseConnectionFailed) as exc:
+            delay = connect_backoff.next()
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise click.ClickException(str(exc))
             if state != type(exc):
-                click.echo(str(exc)+' retrying...')
-                state = type(exc)
-        except DatabaseConnectionFailed as exc:
-            if state != type(exc):
-                click.echo(str(exc)+' retrying...')
+                click.echo(str(exc)+' retrying...', err=True)
                 state = type(exc)
+            time.sleep(delay)
         else:
-            state = None
             break
-        time.sleep(3)
-        if not retry:
-            click.exit(1)
-        
+
     columns = columns.split(',') if columns else []
     filters = filters.split(',') if filters else []
     if template:
-        if template.startswith('@'):
-            template_path = Path(template[1:])
-            if not template_path.is_file():
-                template_path = Path.home() / '.sqltail' / template[1:]
-            template = template_path.read_text()
+        columns = read_template(template)
 
-        columns = from_json(template)
+    # a json object template maps table names to their own fields and filters
+    if isinstance(columns, dict):
+        tables = {t: columns[t] for t in (table or columns.keys())}
+        columns = []
+    else:
+        tables = {t: {} for t in (table or ['log'])}
 
-    sql_tail = SQLTail(
-        db, 
-        table=table,
+    if probe == 'auto':
+        probe = 'max_id' if filters else 'none'
+
+    row_format = {None: 'text', 'json': 'ndjson'}.get(output_format, output_format)
+    writer = BatchWriter(click.get_text_stream('stdout'), binary=row_format == 'msgpack')
+    options = dict(
         fields=columns, 
         filters=filters,
-        callbacks=[output],
         tz=timezone,
-        interval=interval
+        interval=interval,
+        min_interval=min_interval,
+        backoff=backoff,
+        jitter=jitter,
+        scheduler=scheduler,
+        probe=None if probe == 'none' else probe,
+        flush_latency=flush_latency,
+        output_format=row_format,
+        persistent=persistent,
+        ping_interval=ping_interval,
+        batch_size=batch_size,
+        checkpoint=checkpoint,
+        checkpoint_interval=checkpoint_interval,
+        catchup_workers=catchup_workers,
+        catchup_chunk=catchup_chunk,
+        schema_cache=schema_cache,
+        schema_ttl=schema_ttl,
+        where=where,
+        time_column=time_column,
+        **window
     )
+    if serve and not (get_template or get_columns):
+        from sqltail.server import TailServer
+        sql_tail = TailServer(db, tables, serve, **options)
+    elif len(tables) == 1:
+        table, spec = list(tables.items())[0]
+        options.update(dict(fields=spec) if isinstance(spec, list) else spec)
+        sql_tail = SQLTail(db, table=table, callbacks=[], batch_callbacks=[writer], **options)
+    else:
+        sql_tail = MultiTail(db, tables, workers=workers, callbacks=[], batch_callbacks=[writer], **options)
+
     if get_template:
-        output(sql_tail.get_field_template(), fmt=output_format)
+        output(sql_tail.get_field_template(), fmt=output_format or 'json')
     elif get_columns:
-        output(sql_tail.get_columns(), fmt=output_format)
+        output(sql_tail.get_columns(), fmt=output_format or 'json')
     else:
-        sql_tail.run(timeout=timeout)
+        tails = getattr(sql_tail, 'tails', [sql_tail])
+        reporter = StatsReporter(sql_tail, stats_file, stats_interval).start() if stats_file else None
+        metrics = None
+        if metrics_port is not None:
+            # http.server, the process pool and the replication client are imported only when used
+            from sqltail.metrics import MetricsServer
+            metrics = MetricsServer(tails, metrics_host, metrics_port).start()
+        try:
+            if binlog:
+                from sqltail.binlog import BinlogTail
+                BinlogTail(tails, events=binlog_events.split(','), server_id=server_id).run(timeout=timeout)
+            elif processes:
+                from sqltail.pipeline import Pipeline
+                Pipeline(sql_tail, processes).run(timeout=timeout)
+            else:
+                sql_tail.run(timeout=timeout)
+        finally:
+            if reporter:
+                reporter.stop()
+            if metrics:
+                metrics.stop()
+
+def read_template(template):
+    """return the json field template, read from FILENAME in cwd or ~/.sqltail for @FILENAME"""
+    if template.startswith('@'):
+        template_path = Path(template[1:])
+        if not template_path.is_file():
+            template_path = Path.home() / '.sqltail' / template[1:]
+        template = template_path.read_text()
+    return from_json(template)
+
+def attach_server(address, table, columns, template, match, where, timezone, output_format, timeout):
+    from sqltail.server import attach
+    if len(table) > 1:
+        raise click.BadParameter('a client attaches to one table', param_hint='--table')
+    table = table[0] if table else None
+    fields = columns.split(',') if columns else None
+    if template:
+        fields = read_template(template)
+        if isinstance(fields, dict):
+            fields = fields[table or 'log']
+    matches = {}
+    for item in match:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise click.BadParameter(f"expected FIELD=VALUE, not {item}", param_hint='--match')
+        matches.setdefault(name, []).append(value)
+    row_format = {None: 'text', 'json': 'ndjson'}.get(output_format, output_format)
+    request = dict(table=table, fields=fields, match=matches, where=where, tz=timezone, output_format=row_format)
+    try:
+        attach(address, request, click.get_binary_stream('stdout'), timeout)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    except OSError as exc:
+        raise click.ClickException(f"cannot attach to {address}: {exc}")
 
 def to_json(data):
-    if hasattr(data, '__iter__'):
+    if isinstance(data, dict):
+        ret = json.dumps(data, indent=2)
+    elif hasattr(data, '__iter__'):
         ret = '[\n  ' + ',\n  '.join([json.dumps(item) for item in data]) + '\n]'
     else:
         ret = json.dumps(data)
@@ -0,0 +1,17 @@
+# sqltail db
+
+from sqltail.db.backend import Backend, Cursor, Row, record_class, DatabaseException, DatabaseConnectionFailed, DatabaseNotFound
+from sqltail.db.connection import Backoff, HostHealth, parse_hosts
+from sqltail.db.mysql import Database
+from sqltail.db.postgres import PostgresDatabase
+from sqltail.db.sqlite import SQLiteDatabase
+
+BACKENDS = {cls.name: cls for cls in (Database, PostgresDatabase, SQLiteDatabase)}
+
+
+def make_database(backend='mysql', **kwargs):
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"unknown backend {backend}; expected one of {', '.join(BACKENDS)}") from None
+    return cls(**kwargs)
@@ -0,0 +1,468 @@
+# sqltail db backend
+
+import functools
+import logging
+import operator
+import os
+import sys
+import time
+import traceback
+import configparser
+import pathlib
+
+from sqltail.db.connection import Backoff, health, parse_hosts
+from sqltail.stats import Stats
+
+class DatabaseException(Exception):
+    """base class for Database exceptions"""
+    pass
+
+class DatabaseConnectionFailed(DatabaseException):
+    pass
+
+class DatabaseNotFound(Exception):
+    """Raised when the expected database is not present."""
+    pass
+
+
+class Backend():
+    """
+    Base class for the database backends.
+
+    A backend opens a DB-API connection to the server and provides the
+    server specific parts of tailing a table: column introspection, the
+    change probe queries, query plan checks, the bind parameter marker, and
+    wait(), which sleeps between polls and may return early when the server
+    signals a change.  Subclasses implement open(), connect() and the
+    methods below which raise NotImplementedError.
+
+    host may be a comma separated list of HOST or HOST:PORT, tried in turn
+    (see HostHealth) when connecting; server is the (host, port) in use.
+    A lost connection is reestablished by recover(), retrying with backoff
+    for up to retry_timeout seconds, or indefinitely if it is None.
+    """
+
+    name = None
+
+    # bind parameter marker of the driver's paramstyle
+    param = '%s'
+
+    def __init__(self, host=None, port=None, user=None, password=None, database=None, config_file=None, debug=False, verbose=False, suffix='', retry_timeout=None):
+
+        self.cxn = None
+        self.generation = 0
+        self.last_used = 0
+        self.stats = Stats()
+        self.debug = debug
+        self.verbose = verbose
+        self.config_file = config_file
+        self.retry_timeout = retry_timeout
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if debug:
+            self.logger.setLevel(logging.DEBUG)
+        self.cfg=self.init_config(config_file)
+        self.init_parameters(host, port, user, password, database, suffix)
+        self.servers = parse_hosts(self.host, self.port)
+        self.server = self.servers[0] if self.servers else (self.host, self.port)
+        self.connection_string = None
+        self.connect_servers(self.open)
+        self.logger.debug(f"{self}")
+
+    def init_config(self, filename):
+        cfg = configparser.ConfigParser()
+        if filename:
+            path = [pathlib.Path(filename)]
+        else:
+            path = [
+                pathlib.Path().home() / '.sqltail',
+                pathlib.Path().home() / '.my.cnf'
+            ]
+        cfg.read(path)
+        return cfg
+
+    def init_parameters(self, host, port, user, password, database, suffix):
+        self.host = self.get_parameter(host, 'DB_HOST', 'client', 'host')
+        self.port = self.get_parameter(port, 'DB_PORT', 'client', 'port')
+        self.user = self.get_parameter(user, 'DB_USER', 'client', 'user')
+        self.password = self.get_parameter(password, 'DB_PASSWORD', 'client', 'password')
+        self.database = self.get_parameter(database, 'DB_DATABASE', 'client', 'database')
+        if suffix:
+            self.database += suffix
+
+    def get_parameter(self, value, env, section, key):
+        if not value:
+            value = os.environ.get(env)
+            if not value:
+                value = self.cfg[section][key]
+        return value
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.cxn:
+            self.cxn.close()
+            self.cxn = None
+
+    def __str__(self):
+        """return string representaton for this instance"""
+        return f'{self.__class__.__name__}<{self.connection_string} {self.cxn}>'
+
+    def clone(self):
+        """return a new instance with its own connection to the same database"""
+        return self.__class__(host=self.host, port=self.port, user=self.user, password=self.password, database=self.database,
+                              config_file=self.config_file, debug=self.debug, verbose=self.verbose, retry_timeout=self.retry_timeout)
+
+    def cursor(self, **kwargs):
+        """return a Cursor configured with the database connection"""
+        return Cursor(self, **kwargs)
+
+    def open(self):
+        """connect to server and verify the database is present, raising DatabaseConnectionFailed or DatabaseNotFound"""
+        raise NotImplementedError
+
+    def connect(self, database=None):
+        """connect to server"""
+        raise NotImplementedError
+
+    def connect_servers(self, connect):
+        """
+        call connect with each server in turn, in the order of the shared
+        host health, until one succeeds, or raise DatabaseConnectionFailed
+        """
+        failure = None
+        for server in health.order(self.servers) or [self.server]:
+            self.server = server
+            try:
+                connect()
+            except DatabaseNotFound:
+                raise
+            except Exception as exc:
+                if not self.is_connection_failure(exc):
+                    raise
+                health.failed(server)
+                if len(self.servers) > 1:
+                    self.logger.warning(f"cannot connect to {server[0]}:{server[1]}: {exc}")
+                failure = exc
+            else:
+                health.succeeded(server)
+                return
+        if isinstance(failure, DatabaseConnectionFailed):
+            raise failure
+        raise DatabaseConnectionFailed(f"Failed connection to database {self.connection_string}: {failure}") from failure
+
+    def is_connection_failure(self, exc):
+        """return True if exc, raised while connecting, means the server could not be used"""
+        if isinstance(exc, DatabaseConnectionFailed):
+            return True
+        # the driver is imported by open(); any of its errors while connecting count
+        return hasattr(self, 'driver') and isinstance(exc, self.query_errors)
+
+    def connected(self):
+        """account for a new connection opened in connect()"""
+        self.stats.count('connects')
+        self.generation += 1
+        self.last_used = time.monotonic()
+
+    @property
+    def connection_errors(self):
+        """exception types indicating the connection was lost and should be reestablished"""
+        raise NotImplementedError
+
+    @property
+    def query_errors(self):
+        """exception type raised for a failed statement"""
+        raise NotImplementedError
+
+    def raw_cursor(self, prepared=False, buffered=False):
+        """return a driver cursor producing tuples"""
+        return self.cxn.cursor()
+
+    def fetch_warnings(self, cursor):
+        """return the server warnings for the last statement run on cursor"""
+        return []
+
+    def commit(self):
+        self.cxn.commit()
+
+    def reconnect(self):
+        """close the connection and open a new one, failing over to another server if this one is down"""
+        self.logger.debug(f"reconnecting {self.connection_string}")
+        if self.cxn:
+            try:
+                self.cxn.close()
+            except self.query_errors:
+                pass
+            self.cxn = None
+        # each attempt's connect() records its own connect time
+        self.connect_servers(lambda: self.connect(self.database))
+        self.stats.count('reconnects')
+
+    def recover(self):
+        """reconnect, retrying with exponential backoff for up to retry_timeout seconds"""
+        backoff = Backoff()
+        deadline = None if self.retry_timeout is None else time.monotonic() + self.retry_timeout
+        while True:
+            try:
+                self.reconnect()
+                return
+            except DatabaseConnectionFailed as exc:
+                delay = backoff.next()
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise
+                self.logger.warning(f"{exc}; retrying in {delay:.2f}s")
+                self.stats.count('retries')
+                time.sleep(delay)
+
+    def ping(self):
+        """raise one of connection_errors if the connection is no longer usable"""
+        cursor = self.raw_cursor()
+        try:
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def check_connection(self, max_idle=None):
+        """ping the server if the connection has been idle for max_idle seconds, reconnecting only on failure"""
+        if max_idle is not None and (time.monotonic() - self.last_used) < max_idle:
+            return
+        self.stats.count('pings')
+        try:
+            self.ping()
+        except self.connection_errors as exc:
+            self.logger.warning(f"{self} ping failed: {exc}")
+            self.recover()
+        else:
+            self.last_used = time.monotonic()
+
+    def get_columns(self, table):
+        """return a Row of the Field (name) and Type of each column of table"""
+        raise NotImplementedError
+
+    def schema_fingerprint(self, table):
+        """return a value which changes with the schema of table, if the server provides one more cheaply than get_columns(), else None"""
+        return None
+
+    def probe_query(self, table, probe):
+        """return the sql and parameters of a query for the newest row id in table, by probe (max_id or auto_increment)"""
+        if probe == 'max_id':
+            # resolved from the end of the primary key index without reading rows
+            return f"SELECT MAX(id) FROM {table};", ()
+        raise ValueError(f"{self.name} does not support the {probe} probe")
+
+    def full_scans(self, sql, params=()):
+        """return a description of each step of the plan for sql which reads a whole table or index"""
+        raise NotImplementedError
+
+    def watch(self, table):
+        """arrange for wait() to return early when rows are added to table, where the server supports it"""
+        pass
+
+    def wait(self, timeout):
+        """wait up to timeout seconds between polls, returning True if a change was signalled"""
+        time.sleep(timeout)
+        return False
+
+
+"""
+The Cursor() class wraps a DB-API cursor from the backend in a context
+manager.  It supports execute() and query() functions, with local
+exception handling passing diagnostic and debugging data to the logging
+system on errors.
+
+Example:
+
+    with Cursor(db) as cursor:
+        rows = cursor.query('SELECT id, message FROM log;')
+
+    for row in rows:
+        print(repr(row))
+
+"""
+
+
+class Cursor():
+    def __init__(self, db, **kwargs):
+        """
+        Cursor() Constructor
+
+        :db: the parent Database instance
+        :param **kwargs: keyword arguments (see below)
+        :return: returns nothing
+
+        The following keyword arguments may be passed boolean values:
+
+        commit - call commit() after each statement
+        ignore_warnings - query() function will request and log MySQL warnings
+        ignore_notes - query() function will ignore 'Note' type warnings
+        dictionary - query() will return rows as type dict
+        tuple - query() will return rows as type tuple
+        record - query() will return rows as compact read-only tuples with attribute access by column name
+        prepared - execute() will prepare the statement on the server once and re-execute it
+            while the same statement string is passed; bind parameters with db.param
+        buffered - passed to the cursor() constructor to modify its function (see MySQL documentation)
+        """
+        self.db = db
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if self.db.debug:
+            self.logger.setLevel(logging.DEBUG)
+        self.sql = ''
+        self.lastrowid = None
+        self.commit = kwargs.get('commit', False)
+        self.ignore_warnings = kwargs.get('ignore_warnings', False)
+        self.ignore_notes = kwargs.get('ignore_notes', True)
+        self.buffered = kwargs.get('buffered', False)
+        self.dictionary = kwargs.get('dictionary', False)
+        self.tuple = kwargs.get('tuple', False)
+        self.prepared = kwargs.get('prepared', False)
+        self.record = kwargs.get('record', False)
+        self.return_rows = True
+        if self.tuple or self.record:
+            self.dictionary = False
+            self.return_rows = False
+        elif self.dictionary:
+            self.return_rows = False
+        else:
+            self.dictionary = True
+            self.return_rows = True
+        # the driver cursor produces tuples; query() builds rows from column_names
+        self.cursor = self.db.raw_cursor(prepared=self.prepared, buffered=self.buffered)
+        self.logger.debug(f"{self}")
+
+    def __str__(self):
+        return f"{__class__.__name__}{self.cursor}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, tb):
+        if self.commit:
+            self.db.commit()
+        self.close()
+
+    def close(self):
+        self.cursor.close()
+
+    def _execute(self, *args, **kwargs):
+        sql = repr(args)
+        self.with_rows = False
+        self.column_names = None
+        self.description = None
+        self.lastrowid = None
+        self.rowcount = 0
+        self.statement=None
+        start = time.perf_counter()
+        try:
+            self.cursor.execute(*args, **kwargs)
+            self.description = self.cursor.description
+            self.with_rows = self.description is not None
+            self.column_names = tuple(d[0] for d in self.description) if self.with_rows else None
+            self.lastrowid = self.cursor.lastrowid
+            self.rowcount = self.cursor.rowcount
+            self.statement = getattr(self.cursor, 'statement', args[0])
+            self.db.last_used = time.monotonic()
+            self.db.stats.observe('execute', time.perf_counter() - start)
+            self.db.stats.count('queries')
+            if self.commit:
+                self.db.commit()
+        except self.db.query_errors as e:
+            self.db.stats.count('errors')
+            f = traceback.extract_stack()[-3]
+            self.logger.error(f"SQL Error {e} caller={f.filename}:{f.lineno} query={sql}")
+            if self.db.verbose:
+                self._dump_sql_error(*args)
+            raise e
+        return self.cursor
+
+    def _dump_sql_error(self, sql, *args):
+        sys.stderr.write('SQL_ERROR_IN:\n' + sql + '\n')
+        sys.stderr.flush()
+
+    def execute(self, *args, **kwargs):
+        self.logger.debug(f"{self} {args} {kwargs}")
+        ret = self._execute(*args, **kwargs)
+        self.logger.debug(f"{self} returning {ret}")
+        return self
+
+    def row_factory(self):
+        """return the function converting a fetched row to the configured row type, or None"""
+        if self.record:
+            return record_class(self.column_names)
+        if self.dictionary:
+            names = self.column_names
+            cls = Row if self.return_rows else dict
+            return lambda row: cls(zip(names, row))
+        return None
+
+    def query(self, *args, **kwargs):
+        self.logger.debug(f"{self} {args} {kwargs}")
+        rows = self._execute(*args, **kwargs).fetchall()
+        if not self.ignore_warnings:
+            self.handle_warnings()
+        factory = self.row_factory()
+        if factory:
+            rows = [factory(row) for row in rows]
+        self.logger.debug(f"{self} returning {len(rows)} {'row' if len(rows)==1 else 'rows'}")
+        if self.db.verbose:
+            for i, row in enumerate(rows):
+                self.logger.debug('row[{i}] {row}')
+        return rows
+
+    def iterate(self, *args, **kwargs):
+        """execute a query and yield rows as they are read from the server instead of fetching them all"""
+        self.logger.debug(f"{self} {args} {kwargs}")
+        cursor = self._execute(*args, **kwargs)
+        factory = self.row_factory()
+        count = 0
+        row = cursor.fetchone()
+        while row is not None:
+            count += 1
+            yield factory(row) if factory else row
+            row = cursor.fetchone()
+        if not self.ignore_warnings:
+            self.handle_warnings()
+        self.logger.debug(f"{self} returned {count} {'row' if count==1 else 'rows'}")
+
+    def handle_warnings(self):
+        for warning in self.db.fetch_warnings(self.cursor) or []:
+            if warning[0] == 'Note' and self.ignore_notes:
+                pass
+            else:
+                self.logger.warning(f"SQL Warning: {warning}")
+
+
+class Row(dict):
+
+    def __getattr__(self, key):
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        raise KeyError('Row is read-only')
+
+    def __setattr__(self, key, value):
+        raise KeyError('Row is read-only')
+
+
+
+@functools.lru_cache(maxsize=64)
+def record_class(names):
+    """
+    Return a tuple subclass for rows with the given column names.
+
+    Records cost no more memory than a plain tuple, and provide read-only
+    attribute access by column name, including names namedtuple rejects
+    such as _id.
+    """
+    attrs = {name: property(operator.itemgetter(i)) for i, name in enumerate(names)}
+    attrs['__slots__'] = ()
+    attrs['_fields'] = names
+    attrs['__repr__'] = lambda self: f"Record({', '.join(f'{k}={v!r}' for k, v in zip(names, self))})"
+    return type('Record', (tuple,), attrs)
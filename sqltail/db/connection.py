@@ -0,0 +1,91 @@
+# sqltail db connection management
+
+import random
+import threading
+import time
+
+RETRY_INITIAL=0.05
+RETRY_MAX=30
+RETRY_MULTIPLIER=2
+RETRY_JITTER=0.5
+
+# seconds a server which refused a connection is tried only after the others
+HOST_COOLDOWN=30
+
+
+def parse_hosts(host, port):
+    """return the (host, port) of each server in host, a comma separated list of HOST or HOST:PORT"""
+    servers = []
+    if not host:
+        return servers
+    for item in str(host).split(','):
+        name, sep, item_port = item.strip().partition(':')
+        if name:
+            servers.append((name, item_port if sep else port))
+    return servers
+
+
+class Backoff():
+    """
+    Exponentially growing delays between connection attempts, from initial
+    to maximum seconds.  Each delay is reduced by a random fraction of up to
+    jitter, so tails which lost the same server do not retry in lockstep.
+    """
+
+    def __init__(self, initial=RETRY_INITIAL, maximum=RETRY_MAX, multiplier=RETRY_MULTIPLIER, jitter=RETRY_JITTER):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.delay = initial
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.initial} {self.maximum} {self.multiplier} {self.jitter}>"
+
+    def next(self):
+        """return the seconds to wait before the next attempt"""
+        delay = self.delay * (1 - random.uniform(0, self.jitter))
+        self.delay = min(self.maximum, self.delay * self.multiplier)
+        return delay
+
+    def reset(self):
+        self.delay = self.initial
+
+
+class HostHealth():
+    """
+    The outcome of recent connections to each server, shared by every
+    connection in the process, so a tail reconnecting after a failover, or a
+    clone opened for a worker, goes straight to the server that is up.
+
+    order() puts the server last connected to first, then the others, then
+    those which failed within cooldown seconds, least recently failed first.
+    """
+
+    def __init__(self, cooldown=HOST_COOLDOWN):
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.last_good = None
+
+    def order(self, servers):
+        now = time.monotonic()
+        with self.lock:
+            cooling = {server: at for server, at in self.failures.items() if now - at < self.cooldown}
+            last_good = self.last_good
+        healthy = sorted((s for s in servers if s not in cooling), key=lambda s: s != last_good)
+        return healthy + sorted((s for s in servers if s in cooling), key=cooling.get)
+
+    def failed(self, server):
+        with self.lock:
+            self.failures[server] = time.monotonic()
+            if self.last_good == server:
+                self.last_good = None
+
+    def succeeded(self, server):
+        with self.lock:
+            self.failures.pop(server, None)
+            self.last_good = server
+
+
+health = HostHealth()
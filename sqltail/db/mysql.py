@@ -0,0 +1,135 @@
+# sqltail db mysql
+
+import time
+
+from sqltail.db.backend import Backend, DatabaseConnectionFailed, DatabaseNotFound
+
+
+class Database(Backend):
+    """MySQL and MariaDB, through mysql.connector"""
+
+    name = 'mysql'
+
+    # ER_BAD_DB_ERROR, unknown database
+    ER_BAD_DB = 1049
+
+    # set by the auto_increment probe, which needs current table statistics
+    fresh_table_stats = False
+
+    def open(self):
+        # imported here, as it takes longer than the rest of sqltail
+        import mysql.connector
+        self.driver = mysql.connector
+        # connecting straight to the database saves listing them, and the
+        # server reports a missing one as error 1049
+        try:
+            self.connect(self.database)
+        except mysql.connector.Error as exc:
+            if exc.errno == self.ER_BAD_DB:
+                raise DatabaseNotFound(f"Database {self.database} is not present.") from None
+            raise DatabaseConnectionFailed(f"Failed connection to database {self.connection_string}: {exc}") from None
+
+    def connect(self, database=None):
+        host, port = self.server
+        self.connection_string = f"mysql://{self.user}@{host}:{port}/{self.database if self.database else ''}"
+        # autocommit gives every statement a fresh snapshot, so a long-lived
+        # connection sees rows committed by other sessions
+        start = time.perf_counter()
+        self.cxn = self.driver.connect(
+            host=host, port=int(port), user=self.user, password=self.password, database=database,
+            consume_results=True, autocommit=True
+        )
+        self.cxn.get_warnings = True
+        if self.fresh_table_stats:
+            self.disable_stats_cache()
+        self.stats.observe('connect', time.perf_counter() - start)
+        self.connected()
+        return self.cxn
+
+    def disable_stats_cache(self):
+        """have information_schema.TABLES report current values, which MySQL 8 caches for a day by default"""
+        cursor = self.cxn.cursor()
+        try:
+            cursor.execute('SET SESSION information_schema_stats_expiry = 0;')
+        except self.driver.Error:
+            # earlier servers and MariaDB do not cache them
+            pass
+        finally:
+            cursor.close()
+
+    @property
+    def connection_errors(self):
+        return (self.driver.errors.OperationalError, self.driver.errors.InterfaceError)
+
+    @property
+    def query_errors(self):
+        return self.driver.Error
+
+    def raw_cursor(self, prepared=False, buffered=False):
+        if prepared:
+            return PreparedCursor(self.cxn.cursor(prepared=True), self.cxn.converter)
+        return self.cxn.cursor(buffered=buffered)
+
+    def fetch_warnings(self, cursor):
+        return cursor.fetchwarnings()
+
+    def commit(self):
+        if self.cxn.in_transaction:
+            self.cxn.commit()
+
+    def ping(self):
+        self.cxn.ping(reconnect=False)
+
+    def get_columns(self, table):
+        with self.cursor() as cursor:
+            return cursor.query(f"DESCRIBE {table};")
+
+    def probe_query(self, table, probe):
+        if probe == 'auto_increment':
+            # MySQL 8 caches this for information_schema_stats_expiry seconds (default
+            # 86400), so the connection, and any it reconnects with, turn the cache off
+            self.fresh_table_stats = True
+            self.disable_stats_cache()
+            sql = f"SELECT AUTO_INCREMENT - 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = {self.param} AND TABLE_NAME = {self.param};"
+            return sql, (self.database, table)
+        return super().probe_query(table, probe)
+
+    def full_scans(self, sql, params=()):
+        with self.cursor() as cursor:
+            plan = cursor.query(f"EXPLAIN {sql}", params)
+        # type is NULL when the optimizer found nothing to read at all
+        return [f"{step.get('type')} scan, key={step.get('key')}" for step in plan
+                if step.get('type') in ('ALL', 'index') or (step.get('type') and not step.get('key'))]
+
+
+class PreparedCursor():
+    """
+    A prepared statement cursor returning the same value types as a plain
+    cursor.  mysql-connector 2.x reads the binary protocol's string and
+    decimal values as bytes; each is converted for its column as the text
+    protocol would, so CHAR and TEXT become str, DECIMAL becomes Decimal,
+    and binary columns stay bytes.
+    """
+
+    def __init__(self, cursor, converter):
+        self.cursor = cursor
+        self.converter = converter
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __str__(self):
+        return str(self.cursor)
+
+    def convert(self, row):
+        if row is None:
+            return None
+        to_python = self.converter.to_python
+        return tuple(to_python(column, value) if isinstance(value, (bytes, bytearray)) else value
+                     for column, value in zip(self.cursor.description, row))
+
+    def fetchone(self):
+        return self.convert(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self.convert(row) for row in self.cursor.fetchall()]
@@ -0,0 +1,112 @@
+# sqltail db postgresql
+
+import select
+import time
+
+from sqltail.db.backend import Backend, DatabaseConnectionFailed, DatabaseNotFound
+
+
+class PostgresDatabase(Backend):
+    """
+    PostgreSQL, through psycopg2 (pip install sqltail[postgresql]).
+
+    Each watched table is LISTENed on the channel sqltail_TABLE, and wait()
+    returns as soon as a notification arrives.  Notifications need a
+    trigger on the table, for example:
+
+        CREATE FUNCTION sqltail_notify() RETURNS trigger AS $$
+        BEGIN PERFORM pg_notify('sqltail_' || TG_TABLE_NAME, ''); RETURN NULL; END
+        $$ LANGUAGE plpgsql;
+        CREATE TRIGGER log_sqltail AFTER INSERT ON log
+        FOR EACH STATEMENT EXECUTE PROCEDURE sqltail_notify();
+
+    Without one, wait() simply sleeps and the tail polls as it would for MySQL.
+    """
+
+    name = 'postgresql'
+
+    def __init__(self, *args, **kwargs):
+        self.channels = []
+        super().__init__(*args, **kwargs)
+
+    def open(self):
+        try:
+            import psycopg2
+        except ImportError as exc:
+            raise DatabaseConnectionFailed('the postgresql backend requires the psycopg2 package') from exc
+        self.driver = psycopg2
+        try:
+            self.connect(self.database)
+        except psycopg2.OperationalError as exc:
+            if 'does not exist' in str(exc):
+                raise DatabaseNotFound(f"Database {self.database} is not present.") from None
+            raise DatabaseConnectionFailed(f"Failed connection to database {self.connection_string}: {exc}") from None
+
+    def connect(self, database=None):
+        host, port = self.server
+        self.connection_string = f"postgresql://{self.user}@{host}:{port}/{database or ''}"
+        start = time.perf_counter()
+        self.cxn = self.driver.connect(host=host, port=int(port), user=self.user, password=self.password, dbname=database)
+        # as for MySQL, autocommit gives every statement a fresh snapshot
+        self.cxn.autocommit = True
+        self.stats.observe('connect', time.perf_counter() - start)
+        self.connected()
+        # LISTEN does not survive the connection
+        cursor = self.cxn.cursor()
+        for channel in self.channels:
+            cursor.execute(f'LISTEN "{channel}";')
+        cursor.close()
+        return self.cxn
+
+    @property
+    def connection_errors(self):
+        return (self.driver.OperationalError, self.driver.InterfaceError)
+
+    @property
+    def query_errors(self):
+        return self.driver.Error
+
+    def fetch_warnings(self, cursor):
+        notices = [('Note', notice.strip()) for notice in self.cxn.notices]
+        del self.cxn.notices[:]
+        return notices
+
+    def get_columns(self, table):
+        schema, _, name = table.rpartition('.')
+        with self.cursor() as cursor:
+            rows = cursor.query(
+                'SELECT column_name AS "Field", data_type AS "Type" FROM information_schema.columns '
+                'WHERE table_schema = COALESCE(%s, current_schema()) AND table_name = %s ORDER BY ordinal_position;',
+                (schema or None, name)
+            )
+        if not rows:
+            raise self.driver.ProgrammingError(f'relation "{table}" does not exist')
+        return rows
+
+    def probe_query(self, table, probe):
+        if probe == 'auto_increment':
+            # the id sequence's last value, without reading the table
+            return "SELECT pg_sequence_last_value(pg_get_serial_sequence(%s, 'id'));", (table,)
+        return super().probe_query(table, probe)
+
+    def full_scans(self, sql, params=()):
+        with self.cursor(tuple=True) as cursor:
+            plan = cursor.query(f"EXPLAIN {sql}", params)
+        return [step[0].strip(' ->') for step in plan if 'Seq Scan' in step[0]]
+
+    def watch(self, table):
+        channel = f"sqltail_{table.rpartition('.')[2]}"
+        if channel not in self.channels:
+            self.channels.append(channel)
+            with self.cursor() as cursor:
+                cursor.execute(f'LISTEN "{channel}";')
+
+    def wait(self, timeout):
+        if not self.channels:
+            return super().wait(timeout)
+        if not self.cxn.notifies:
+            if select.select([self.cxn], [], [], timeout)[0]:
+                self.cxn.poll()
+        notified = bool(self.cxn.notifies)
+        del self.cxn.notifies[:]
+        return notified
@@ -0,0 +1,113 @@
+# sqltail db sqlite
+
+import datetime
+import pathlib
+import sqlite3
+import time
+
+from sqltail.db.backend import Backend, DatabaseNotFound
+
+# seconds between PRAGMA data_version checks in wait()
+DATA_VERSION_INTERVAL=0.05
+
+
+def convert_datetime(value):
+    """parse DATETIME and TIMESTAMP column text, which sqlite stores as given"""
+    value = value.decode()
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+# converters apply to columns declared with these types, given detect_types
+sqlite3.register_converter('DATETIME', convert_datetime)
+sqlite3.register_converter('TIMESTAMP', convert_datetime)
+
+
+class SQLiteDatabase(Backend):
+    """
+    A SQLite database file.
+
+    database is the path of the file, which must exist; host, port, user,
+    password and suffix are ignored.  wait() checks PRAGMA data_version,
+    which changes when another connection commits to the file, returning
+    as soon as it does instead of sleeping out the interval.
+    """
+
+    name = 'sqlite'
+    param = '?'
+
+    def init_parameters(self, host, port, user, password, database, suffix):
+        self.host = self.port = self.user = self.password = None
+        self.database = self.get_parameter(database, 'DB_DATABASE', 'client', 'database')
+        self.data_version = None
+
+    def open(self):
+        if not pathlib.Path(self.database).is_file():
+            raise DatabaseNotFound(f"Database {self.database} is not present.")
+        self.connect(self.database)
+
+    def connect(self, database=None):
+        self.connection_string = f"sqlite:///{database}"
+        start = time.perf_counter()
+        # mode=rw so a mistyped path is not silently created; isolation_level None is autocommit
+        uri = pathlib.Path(database).absolute().as_uri() + '?mode=rw'
+        self.cxn = sqlite3.connect(uri, uri=True, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self.stats.observe('connect', time.perf_counter() - start)
+        self.connected()
+        return self.cxn
+
+    @property
+    def connection_errors(self):
+        return (sqlite3.InterfaceError,)
+
+    @property
+    def query_errors(self):
+        return sqlite3.Error
+
+    def ping(self):
+        # there is no server connection to lose
+        pass
+
+    def get_columns(self, table):
+        with self.cursor() as cursor:
+            rows = cursor.query('SELECT name AS Field, lower(type) AS Type FROM pragma_table_info(?);', (table,))
+        if not rows:
+            raise sqlite3.OperationalError(f"no such table: {table}")
+        return rows
+
+    def schema_fingerprint(self, table):
+        # incremented by every schema change to the file
+        return self.cxn.execute('PRAGMA schema_version;').fetchone()[0]
+
+    def probe_query(self, table, probe):
+        # sqlite_sequence only covers tables declared AUTOINCREMENT, and MAX(id)
+        # of an integer primary key is a single b-tree seek anyway
+        return super().probe_query(table, 'max_id')
+
+    def full_scans(self, sql, params=()):
+        with self.cursor() as cursor:
+            plan = cursor.query(f"EXPLAIN QUERY PLAN {sql}", params)
+        # SEARCH steps use an index range; SCAN steps read the whole table or index
+        return [step.detail for step in plan if step.detail.startswith('SCAN')]
+
+    def get_data_version(self):
+        cursor = self.cxn.execute('PRAGMA data_version;')
+        return cursor.fetchone()[0]
+
+    def watch(self, table):
+        self.data_version = self.get_data_version()
+
+    def wait(self, timeout):
+        if self.data_version is None:
+            return super().wait(timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            version = self.get_data_version()
+            if version != self.data_version:
+                self.data_version = version
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(DATA_VERSION_INTERVAL, remaining))
@@ -0,0 +1,266 @@
+# sqltail client-side filters
+
+import operator
+import re
+
+"""
+A small expression language for filtering rows in sqltail instead of in
+the database's WHERE clause:
+
+    level == 'ERROR' and message ~ 'timeout|refused'
+    level in ('WARNING', 'ERROR') or not host like 'web%'
+    user_id >= 1000 and session is not null
+
+Comparisons (== or =, != or <>, <, <=, >, >=) take a string or number
+literal.  Against a string literal, values are compared as strings, so
+datetimes compare as 'YYYY-MM-DD HH:MM:SS'; against a number, string
+values are converted to numbers.  `~` and `!~` search with a Python
+regular expression, `like` and `not like` match an SQL LIKE pattern
+(case-insensitive), and `in`, `not in`, `is null` and `is not null` work
+as in SQL.  Conditions combine with and, or, not and parentheses.
+Keywords are case-insensitive.
+
+As in SQL, NULL matches no comparison, and neither does its negation:
+`not level == 'INFO'` and `level !~ 'DEBUG'` skip rows where level is
+null.  Only `is null` matches them.
+"""
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>-?\d+(?:\.\d+)?)
+   |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+   |(?P<op>==|!=|<>|<=|>=|!~|[=<>~(),])
+   |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+)""", re.X)
+
+COMPARISONS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne, '<>': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+KEYWORDS = ['and', 'or', 'not', 'in', 'is', 'null', 'like']
+
+
+class FilterError(ValueError):
+    """Raised for an expression which cannot be parsed, or names an unknown field."""
+    pass
+
+
+def tokenize(expression):
+    """return the (kind, value) tokens of expression, ending with ('end', None)"""
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = TOKEN.match(expression, pos)
+        if not match:
+            raise FilterError(f"unexpected {expression[pos:].strip()[:20]!r} in filter {expression!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'name' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    tokens.append(('end', None))
+    return tokens
+
+
+def like_regex(pattern):
+    """return a compiled regular expression matching the SQL LIKE pattern"""
+    parts = ['.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern]
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+
+class Parser():
+    """recursive descent parser producing the expression tree of a filter"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.pos = 0
+
+    def parse(self):
+        node = self.parse_or()
+        self.expect('end')
+        return node
+
+    def peek(self, kind, value=None):
+        token = self.tokens[self.pos]
+        return token[0] == kind and (value is None or token[1] == value)
+
+    def accept(self, kind, value=None):
+        if self.peek(kind, value):
+            self.pos += 1
+            return self.tokens[self.pos - 1][1]
+        return None
+
+    def expect(self, kind, value=None):
+        if not self.peek(kind, value):
+            found = self.tokens[self.pos][1]
+            wanted = value or kind
+            raise FilterError(f"expected {wanted} but found {'the end' if found is None else repr(found)} in filter {self.expression!r}")
+        return self.accept(kind, value)
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.accept('keyword', 'or'):
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.accept('keyword', 'and'):
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.accept('keyword', 'not'):
+            return ('not', self.parse_not())
+        if self.accept('op', '('):
+            node = self.parse_or()
+            self.expect('op', ')')
+            return node
+        return self.parse_condition()
+
+    def parse_condition(self):
+        name = self.expect('name')
+        if self.accept('keyword', 'is'):
+            negate = self.accept('keyword', 'not')
+            self.expect('keyword', 'null')
+            node = ('null', name)
+        else:
+            negate = self.accept('keyword', 'not')
+            if self.accept('keyword', 'in'):
+                node = ('in', name, self.parse_list())
+            elif self.accept('keyword', 'like'):
+                node = ('regex', name, like_regex(self.expect('string')), True)
+            elif negate:
+                raise FilterError(f"expected in or like after not in filter {self.expression!r}")
+            elif self.accept('op', '~'):
+                node = ('regex', name, self.parse_regex(), False)
+            elif self.accept('op', '!~'):
+                node = ('not', ('regex', name, self.parse_regex(), False))
+            else:
+                op = self.tokens[self.pos][1]
+                if not (self.peek('op') and op in COMPARISONS):
+                    self.expect('comparison')
+                self.pos += 1
+                node = ('compare', name, op, self.parse_literal())
+        return ('not', node) if negate else node
+
+    def parse_literal(self):
+        if self.peek('string') or self.peek('number'):
+            return self.accept(self.tokens[self.pos][0])
+        return self.expect('literal')
+
+    def parse_list(self):
+        self.expect('op', '(')
+        values = [self.parse_literal()]
+        while self.accept('op', ','):
+            values.append(self.parse_literal())
+        self.expect('op', ')')
+        return values
+
+    def parse_regex(self):
+        pattern = self.expect('string')
+        try:
+            return re.compile(pattern)
+        except re.error as exc:
+            raise FilterError(f"invalid regular expression {pattern!r}: {exc}") from None
+
+
+def compile_comparison(index, op, literal):
+    func = COMPARISONS[op]
+    if isinstance(literal, str):
+        def test(row):
+            value = row[index]
+            if value is None:
+                return False
+            return func(value if isinstance(value, str) else str(value), literal)
+    else:
+        def test(row):
+            value = row[index]
+            if value is None:
+                return False
+            try:
+                if isinstance(value, (str, bytes)):
+                    value = float(value)
+                return func(value, literal)
+            except (TypeError, ValueError):
+                return False
+    return test
+
+
+class Filter():
+    """
+    A parsed filter expression.
+
+    names is the set of field names the expression uses.  compile() returns
+    a predicate over tail rows, tuples of _id and the values of the named
+    fields, built once from closures so each row costs only the tests
+    themselves.  `not` is pushed down to the conditions by De Morgan's
+    laws, where a negated test of a null value is false, which keeps the
+    rows SQL's three-valued logic would.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tree = Parser(expression).parse()
+        self.names = set()
+        self.find_names(self.tree)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.expression}>"
+
+    def find_names(self, node):
+        if node[0] in ('and', 'or', 'not'):
+            for child in node[1:]:
+                self.find_names(child)
+        else:
+            self.names.add(node[1])
+
+    def compile(self, names):
+        """return a predicate over rows of _id followed by the values of names"""
+        unknown = sorted(self.names - set(names))
+        if unknown:
+            raise FilterError(f"filter {self.expression!r} uses unknown field {', '.join(unknown)}; expected one of {', '.join(names)}")
+        index = {name: i + 1 for i, name in enumerate(names)}
+        return self.compile_node(self.tree, index)
+
+    def compile_node(self, node, index, negate=False):
+        kind = node[0]
+        if kind in ('or', 'and'):
+            left, right = self.compile_node(node[1], index, negate), self.compile_node(node[2], index, negate)
+            if (kind == 'or') != negate:
+                return lambda row: left(row) or right(row)
+            return lambda row: left(row) and right(row)
+        if kind == 'not':
+            return self.compile_node(node[1], index, not negate)
+        i = index[node[1]]
+        if kind == 'null':
+            if negate:
+                return lambda row: row[i] is not None
+            return lambda row: row[i] is None
+        test = self.compile_condition(node, i)
+        if negate:
+            return lambda row: row[i] is not None and not test(row)
+        return test
+
+    def compile_condition(self, node, i):
+        kind = node[0]
+        if kind == 'regex':
+            search = node[2].fullmatch if node[3] else node[2].search
+            return lambda row: row[i] is not None and search(row[i] if isinstance(row[i], str) else str(row[i])) is not None
+        if kind == 'in':
+            strings = set(value for value in node[2] if isinstance(value, str))
+            numbers = [compile_comparison(i, '==', value) for value in node[2] if not isinstance(value, str)]
+            return lambda row: row[i] is not None and ((str(row[i]) in strings) or any(test(row) for test in numbers))
+        return compile_comparison(i, node[2], node[3])
+
+
+def compile_filter(expression, names):
+    """return a predicate over rows of _id followed by the values of names, true for rows matching expression"""
+    return Filter(expression).compile(names)
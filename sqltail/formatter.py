@@ -0,0 +1,94 @@
+# sqltail formatter
+
+import datetime
+
+TZ_CACHE_SIZE=4096
+
+
+class DatetimeFormatter():
+    """
+    Format a datetime exactly as arrow.get(dt).to(tz).isoformat(' ')[:24] does,
+    without building an arrow object for every value.
+
+    Naive datetimes are taken as UTC, as arrow does.  The utc offset of tz is
+    looked up once per quarter hour of UTC time and cached; every timezone
+    transition falls on a quarter hour boundary.
+    """
+
+    def __init__(self, tz):
+        self.tz = tz
+        if tz in ('UTC', 'utc'):
+            # the default; saves importing arrow
+            self.tzinfo = datetime.timezone.utc
+        else:
+            import arrow
+            self.tzinfo = arrow.utcnow().to(tz).tzinfo
+        self.cache = {}
+        self.__name__ = 'fmt_datetime'
+
+    def __call__(self, dt):
+        if not isinstance(dt, datetime.datetime):
+            import arrow
+            return arrow.get(dt).to(self.tz).isoformat(' ')[:24]
+        dt, (delta, suffix, tzinfo) = self.offset(dt)
+        # str() of a naive datetime is its isoformat(' ') without the utc offset suffix
+        return (str(dt + delta) + suffix)[:24]
+
+    def isoformat(self, dt):
+        """return the full ISO 8601 representation of dt in tz"""
+        dt, (delta, suffix, tzinfo) = self.offset(dt)
+        return (dt + delta).replace(tzinfo=tzinfo).isoformat()
+
+    def offset(self, dt):
+        """return dt as naive utc, and the cached offset of tz at that time"""
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        key = (dt.toordinal() * 24 + dt.hour) * 4 + dt.minute // 15
+        offset = self.cache.get(key)
+        if offset is None:
+            offset = self.lookup(dt)
+            if len(self.cache) >= TZ_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[key] = offset
+        return dt, offset
+
+    def lookup(self, dt):
+        """return the utc offset of tz at utc time dt, its isoformat suffix, and a fixed tzinfo for it"""
+        local = dt.replace(tzinfo=datetime.timezone.utc).astimezone(self.tzinfo)
+        delta = local.utcoffset()
+        tzinfo = datetime.timezone(delta) if delta else datetime.timezone.utc
+        return delta, local.replace(microsecond=0).isoformat(' ')[19:], tzinfo
+
+
+def compile_str(left_pad=0, right_pad=0, truncate=0):
+    """return a function equivalent to Field.fmt_str for the given options"""
+    if left_pad:
+        if truncate:
+            return lambda value: str(value).rjust(left_pad)[-truncate:]
+        return lambda value: str(value).rjust(left_pad)
+    if right_pad:
+        if truncate:
+            return lambda value: str(value).ljust(right_pad)[:truncate]
+        return lambda value: str(value).ljust(right_pad)
+    if truncate:
+        return lambda value: str(value)[:truncate]
+    return str
+
+
+def compile_formatter(funcs, delimiter=' ', offset=0, keys=None):
+    """
+    Generate a single function formatting a row with one function per field.
+
+    With keys, rows are mappings and field i is row[keys[i]]; otherwise rows
+    are sequences and field i is row[offset+i].  The generated function is
+    a single join over the field values, with no per-field dispatch.
+    """
+    namespace = {f"f{i}": func for i, func in enumerate(funcs)}
+    namespace['join'] = delimiter.join
+    if keys is None:
+        args = [f"f{i}(row[{offset + i}])" for i in range(len(funcs))]
+    else:
+        args = [f"f{i}(row[{key!r}])" for i, key in enumerate(keys)]
+    source = f"def format_row(row):\n    return join(({', '.join(args)}{',' if len(args) == 1 else ''}))\n"
+    exec(source, namespace)
+    return namespace['format_row']
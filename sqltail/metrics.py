@@ -0,0 +1,136 @@
+# sqltail metrics
+
+import http.server
+import logging
+import socketserver
+import threading
+
+METRICS_HOST='127.0.0.1'
+METRICS_PORT=9408
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+QUANTILES = [('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99')]
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_metrics(tails, openmetrics=False):
+    """
+    Return the metrics of each tail in Prometheus text format, or OpenMetrics.
+
+    Each tail's samples are labelled with its host, database and table.
+    lag_rows is the newest id seen (by the probe, the MAX(id) read while
+    a backlog is polled, or the tail query) less the last id output.
+    """
+    families = {}
+
+    def add(name, kind, help, labels, value, suffix=''):
+        if value is None:
+            return
+        family = families.setdefault(name, (kind, help, []))
+        family[2].append((suffix, labels, value))
+
+    for tail in tails:
+        stats = tail.get_stats()
+        labels = dict(host=tail.db.host, database=tail.db.database, table=tail.table)
+        last_id = stats['last_id']
+        newest_id = stats['probe']['newest_id']
+        add('sqltail_last_id', 'gauge', 'id of the last row output', labels, last_id)
+        add('sqltail_newest_id', 'gauge', 'newest row id seen in the table', labels, newest_id)
+        if last_id is not None and newest_id is not None:
+            add('sqltail_lag_rows', 'gauge', 'row ids between the newest row seen and the last row output', labels, max(0, newest_id - last_id))
+        counters = stats['tail']
+        db = stats['db']
+        add('sqltail_rows', 'counter', 'rows output', labels, counters.get('rows', 0), '_total')
+        add('sqltail_bytes_out', 'counter', 'bytes of encoded output', labels, counters.get('bytes_out', 0), '_total')
+        add('sqltail_polls', 'counter', 'polls', labels, counters.get('polls', 0), '_total')
+        add('sqltail_empty_polls', 'counter', 'polls which returned no rows', labels, counters.get('empty_polls', 0), '_total')
+        add('sqltail_reconnects', 'counter', 'database reconnections', labels, db.get('reconnects', 0), '_total')
+        add('sqltail_rows_per_second', 'gauge', 'mean output rate since start', labels, counters.get('rows_per_sec'))
+        for stage, name, help in (('poll', 'sqltail_poll_latency_seconds', 'poll latency'), ('lag', 'sqltail_lag_seconds', 'row timestamp to output delay')):
+            histogram = counters['stages'].get(stage)
+            if not histogram:
+                continue
+            for quantile, key in QUANTILES:
+                add(name, 'summary', help, dict(labels, quantile=quantile), histogram[key])
+            add(name, 'summary', help, labels, histogram['mean'] * histogram['count'], '_sum')
+            add(name, 'summary', help, labels, histogram['count'], '_count')
+
+    lines = []
+    for name, (kind, help, samples) in families.items():
+        family = name if openmetrics or kind != 'counter' else name + '_total'
+        lines.append(f"# HELP {family} {help}")
+        lines.append(f"# TYPE {family} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer():
+    """
+    Serve the metrics of a set of tails at http://host:port/metrics from a
+    daemon thread.  The listener binds to localhost unless told otherwise.
+    Requests read the tails' stats while they poll; Stats.snapshot() copies
+    them under its lock.
+    """
+
+    def __init__(self, tails, host=METRICS_HOST, port=METRICS_PORT):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tails = tails
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.host}:{self.port}>"
+
+    def start(self):
+        tails = self.tails
+        logger = self.logger
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+                try:
+                    body = render_metrics(tails, openmetrics).encode()
+                except Exception as exc:
+                    logger.error(f"rendering metrics failed: {exc}")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.logger.info(f"serving metrics at http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
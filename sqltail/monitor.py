@@ -1,8 +1,16 @@
-import arrow
 import datetime
 import logging
 import time
-import copy
+
+from sqltail.catchup import CatchUp, CATCHUP_CHUNK
+from sqltail.checkpoint import Checkpoint, CHECKPOINT_INTERVAL
+from sqltail.filters import Filter
+from sqltail.formatter import DatetimeFormatter, compile_formatter, compile_str
+from sqltail.output import make_encoder
+from sqltail.schema import SchemaCache, SCHEMA_TTL
+from sqltail.stats import Stats
+from sqltail.window import TimeWindow, parse_time
+from sqltail.scheduler import Scheduler, make_scheduler, WAIT_INTERVAL_INIT, WAIT_INTERVAL_MULTIPLIER, WAIT_INTERVAL_MAX, JITTER
 
 """
 ideas:
@@ -19,12 +27,16 @@ ideas:
 TZ='UTC'
 DATETIME_FIELD_NAMES = ['timestamp', 'created', 'updated']
 
-WAIT_INTERVAL_INIT=0.1
-WAIT_INTERVAL_MULTIPLIER=2
-WAIT_INTERVAL_MAX=1
+PING_INTERVAL=30
+BATCH_SIZE=1000
+PROBES = ['max_id', 'auto_increment']
+FLUSH_LATENCY=0.1
 
 class SQLTail():
-    def __init__(self, db, table='log', fields=[], filters=[], delimiter=' ', interval=1, callbacks=[print], tz=TZ):
+    def __init__(self, db, table='log', fields=[], filters=[], delimiter=' ', interval=WAIT_INTERVAL_MAX, callbacks=[print], tz=TZ, persistent=True, ping_interval=PING_INTERVAL, batch_size=BATCH_SIZE, checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 scheduler='backoff', min_interval=WAIT_INTERVAL_INIT, backoff=WAIT_INTERVAL_MULTIPLIER, jitter=JITTER, probe=None,
+                 batch_callbacks=[], flush_latency=FLUSH_LATENCY, output_format='text', tag=False, catchup_workers=0, catchup_chunk=CATCHUP_CHUNK,
+                 schema_cache=None, schema_ttl=SCHEMA_TTL, where=None, since=None, until=None, time_column=None):
 
         self.logger=logging.getLogger(__class__.__name__)
 
@@ -33,11 +45,68 @@ class SQLTail():
         self.tz = tz
         self.delimiter = delimiter
         self.interval = interval
+        if not isinstance(scheduler, Scheduler):
+            scheduler = make_scheduler(scheduler, min_interval=min_interval, max_interval=interval, backoff=backoff, jitter=jitter)
+        self.scheduler = scheduler
         self.callbacks=callbacks
+        self.batch_callbacks = batch_callbacks
+        self.flush_latency = flush_latency
+        self.pending = []
+        self.pending_since = None
+        self.pending_id = None
         self.filters = filters
+        self.persistent = persistent
+        self.ping_interval = ping_interval
+        self.batch_size = batch_size
+        self.catchup_workers = catchup_workers
+        self.catchup_chunk = catchup_chunk
+        if probe and probe not in PROBES:
+            raise ValueError(f"unknown probe {probe}; expected one of {', '.join(PROBES)}")
+        self.probe = probe
+        self.probe_id = None
+        self.newest_id = None
+        self.probes = 0
+        self.probes_skipped = 0
+        self.backlog = False
+        self.stats = Stats()
+        self.format_time = 0
+        self.callback_time = 0
+        self.schema_cache = SchemaCache(schema_cache, schema_ttl) if schema_cache else None
+        self.schema_key = SchemaCache.make_key(db, table)
         self.columns = self.get_columns()
-        self.fields = self.init_fields(fields)
-        self.sql_fields = ','.join([f for f in self.fields])
+        try:
+            self.fields = self.init_fields(fields)
+        except ValueError:
+            if not self.schema_cache:
+                raise
+            # the cached columns may predate a field
+            self.columns = self.get_columns(refresh=True)
+            self.fields = self.init_fields(fields)
+        self.where_clauses = self.init_where_clauses()
+        self.sql_filter = ' AND '.join(f"({clause})" for clause in self.where_clauses)
+        self.where = Filter(where) if where else None
+        self.row_names = self.init_row_names()
+        self.predicate = self.where.compile(self.row_names) if self.where else None
+        self.checkpoint = None
+        if checkpoint:
+            key = Checkpoint.make_key(db.host, db.port, db.database, table, self.where_clauses + ([f"where {where}"] if where else []))
+            self.checkpoint = Checkpoint(checkpoint, key, checkpoint_interval)
+        self.sql_fields = ','.join(self.row_names)
+        self.init_formatters()
+        self.lag_index = self.init_lag_index()
+        self.output_format = output_format
+        self.tag = tag
+        self.init_encoder()
+        # built once; the prepared cursor only re-prepares when passed a different string object
+        limit = f" LIMIT {int(self.batch_size)}" if self.batch_size else ''
+        self.sql_tail = f"SELECT id as _id,{self.sql_fields} FROM {self.table} {self.sql_where(f'id > {self.db.param}')} ORDER BY id{limit};"
+        self.sql_range = f"SELECT id as _id,{self.sql_fields} FROM {self.table} {self.sql_where(f'id > {self.db.param} AND id <= {self.db.param}')} ORDER BY id{limit};"
+        self.window = self.init_window(since, until, time_column)
+        self.end_id = None
+        self.sql_probe, self.probe_params = self.db.probe_query(self.table, self.probe) if self.probe else (None, ())
+        self.cursors = {}
+        if self.where_clauses:
+            self.explain()
         self.logger.debug(f"{self}")
 
     def __str__(self):
@@ -64,82 +133,356 @@ class SQLTail():
         else:
             raise TypeError('fields may be a list of either column names or field specifiers') 
 
+        unknown = [name for name in (fields or ret) if name not in column_map]
+        if unknown:
+            raise ValueError(f"{self.table} has no column {', '.join(unknown)}")
         if fields:
             for field in fields:
                 column = column_map[field]
-                hint = 'datetime' if column.Type.startswith('datetime') else None
+                hint = 'datetime' if column.Type.lower().startswith(('datetime', 'timestamp')) else None
                 ret[column.Field] = Field(column.Field, tz=self.tz, type_hint=hint)
         return ret 
             
-    def get_columns(self):
-        with self.db.cursor() as cursor:
-            return cursor.query(f"DESCRIBE {self.table};")
+    def init_where_clauses(self):
+        """return the filters followed by the where_clause of each field"""
+        return list(self.filters) + [field.sql_where() for field in self.fields.values() if field.where_clause]
+
+    def init_row_names(self):
+        """return the field names followed by any other columns the client-side filter uses"""
+        names = list(self.fields)
+        if self.where:
+            columns = [c.Field for c in self.columns]
+            unknown = sorted(self.where.names - set(columns))
+            if unknown:
+                raise ValueError(f"{self.table} has no column {', '.join(unknown)}")
+            # read after the fields, which the formatters and encoders stop at
+            names += [name for name in columns if name in self.where.names and name not in self.fields]
+        return names
+
+    def init_window(self, since, until, time_column):
+        """return the TimeWindow for since and until (strings for parse_time in tz, or UTC datetimes), or None"""
+        if since is None and until is None:
+            return None
+        columns = [c.Field for c in self.columns]
+        if time_column is None:
+            candidates = [name for name in DATETIME_FIELD_NAMES[:2] if name in columns]
+            candidates += [c.Field for c in self.columns if c.Type.lower().startswith(('datetime', 'timestamp'))]
+            if not candidates:
+                raise ValueError(f"{self.table} has no timestamp column to resolve since and until; set time_column")
+            time_column = candidates[0]
+        elif time_column not in columns:
+            raise ValueError(f"{self.table} has no column {time_column}")
+        since = parse_time(since, self.tz) if since is not None else None
+        until = parse_time(until, self.tz) if until is not None else None
+        return TimeWindow(self, time_column, since, until)
+
+    def explain(self):
+        """
+        EXPLAIN the tail query, raising ValueError if the server rejects the
+        filters, and warning if they prevent it from using an index with id.
+        """
+        with self.db.cursor(tuple=True) as cursor:
+            rows = cursor.query(f"SELECT MAX(id) FROM {self.table};")
+            last_id = rows[0][0] if rows and rows[0][0] is not None else 0
+        sql = f"SELECT id FROM {self.table} {self.sql_where(f'id > {self.db.param}')} ORDER BY id;"
+        try:
+            scans = self.db.full_scans(sql, (last_id,))
+        except self.db.query_errors as exc:
+            raise ValueError(f"invalid filter for {self.table}: {getattr(exc, 'msg', exc)}") from None
+        for scan in scans:
+            self.logger.warning(f"{self.table}: filter {self.sql_filter} cannot use an index with id ({scan}); each poll may read the whole table")
+
+    def init_formatters(self):
+        """compile the fields into row formatters for tuple rows (led by _id) and dict rows"""
+        funcs = [field.compile() for field in self.fields.values()]
+        self.format_tuple = compile_formatter(funcs, self.delimiter, offset=1)
+        self.format_dict = compile_formatter(funcs, self.delimiter, keys=list(self.fields))
+
+    def init_lag_index(self):
+        """return the tail row index of the timestamp used to measure output lag, or None"""
+        for i, (name, field) in enumerate(self.fields.items()):
+            if name in DATETIME_FIELD_NAMES[:2] and field.fmt == field.fmt_datetime:
+                return i + 1
+        return None
+
+    def init_encoder(self, events=False):
+        """set the encoder producing output records; events adds the binlog event to structured records"""
+        self.encoder = make_encoder(self.output_format, self, self.tag, events)
+        self.encode = self.encoder.encode
+
+    def get_columns(self, refresh=False):
+        """return the table's columns, from the schema cache if it has them unless refresh"""
+        if not self.schema_cache:
+            return self.db.get_columns(self.table)
+        fingerprint = self.db.schema_fingerprint(self.table)
+        columns = None if refresh else self.schema_cache.get(self.schema_key, fingerprint)
+        if columns is None:
+            columns = self.db.get_columns(self.table)
+            self.schema_cache.put(self.schema_key, fingerprint, columns)
+        return columns
 
     def get_field_template(self):
         return [field.template() for field in self.fields.values()]
 
     def run(self, timeout=None):
         self.logger.debug('run: begin')
-        if timeout:
-            timeout = arrow.utcnow() + datetime.timedelta(seconds=timeout)
+        deadline = time.monotonic() + timeout if timeout else None
+        self.start()
+        try:
+            self.catch_up()
+            while self.running:
+                count = self.poll()
+                wait = self.next_wait(count)
+                if not count and deadline and time.monotonic() > deadline:
+                    self.logger.debug('Timeout')
+                    self.running = False
+                elif wait:
+                    # only a full batch is followed at once by the next poll
+                    self.db.wait(wait)
+        finally:
+            # saves the checkpoint and closes the cursors on an interrupt or a failed poll too
+            self.stop()
+        self.logger.info(f"stats: {self.get_stats()}")
+        self.logger.debug('run: end')
+
+    def start(self):
+        """set last_id from the time window, the checkpoint or the current end of the table"""
         self.running = True
-        last_id = self.get_last_row_id()
-        wait_interval = WAIT_INTERVAL_INIT
-        while self.running:
-            self.db.cxn.reconnect()
-            self.db.cxn.database = self.db.database
-            self.logger.debug(f"Querying new rows since last_id {last_id}...")
-            with self.db.cursor() as cursor:
-                rows = self.get_new_rows(cursor, last_id)
-            if len(rows):
-                wait_interval = WAIT_INTERVAL_INIT
-                self.logger.debug(f"{len(rows)} row{'' if len(rows)==1 else 's'} returned")
-                self.output_rows(rows)
-                last_id = rows[-1]._id
-            elif timeout and (arrow.utcnow() > timeout):
-                self.logger.debug('Timeout')
-                self.running = False
-            else:
-                if wait_interval < WAIT_INTERVAL_MAX:
-                    wait_interval *= WAIT_INTERVAL_MULTIPLIER
+        last_id = None
+        if self.window:
+            # the window's ids are bound now, so until excludes rows added later
+            last_id, self.end_id = self.window.resolve()
+        if last_id is None and self.checkpoint:
+            last_id = self.checkpoint.load()
+            if last_id is not None:
+                self.logger.info(f"Resuming from checkpoint last_id {last_id}")
+        if last_id is None:
+            last_id = self.get_last_row_id()
+        self.last_id = last_id
+        self.probe_id = last_id
+        self.newest_id = last_id
+        self.backlog = False
+        self.db.watch(self.table)
+
+    def catch_up(self):
+        """with catchup_workers, read a backlog of more than catchup_chunk ids in parallel before polling"""
+        if not self.catchup_workers:
+            return 0
+        return CatchUp(self, self.catchup_workers, self.catchup_chunk).run()
+
+    def poll(self, output=None):
+        """
+        pass each row added since last_id to output (default output_row),
+        returning the number of rows output
+        """
+        output = output or self.output_row
+        start = time.perf_counter()
+        if self.persistent:
+            self.db.check_connection(self.ping_interval)
+        else:
+            self.db.recover()
+        self.stats.count('polls')
+        newest = None
+        row = None
+        count = 0
+        skipped = 0
+        predicate = self.predicate
+        self.format_time = self.callback_time = 0
+        try:
+            if self.probe and not self.backlog and self.end_id is None:
+                probe_start = time.perf_counter()
+                newest = self.get_newest_id()
+                self.stats.observe('probe', time.perf_counter() - probe_start)
+                if newest is None or newest <= self.probe_id:
+                    self.probes_skipped += 1
+                    return 0
+                if self.probe == 'auto_increment':
+                    # ids are allocated before their inserts commit, so AUTO_INCREMENT may
+                    # count rows the tail query cannot see yet; only ids committed before
+                    # the query may be skipped by later probes
+                    newest = min(newest, self.get_last_row_id())
+            self.logger.debug(f"Querying new rows since last_id {self.last_id}...")
+            query_start = time.perf_counter()
+            # rows are streamed and output as they arrive; last_id tracks each row
+            # so a dropped connection resumes exactly where the output stopped
+            for row in self.get_new_rows(self.last_id):
+                if predicate is None or predicate(row):
+                    output(row)
                 else:
-                    wait_interval = WAIT_INTERVAL_MAX
-                self.logger.debug('No rows returned; sleeping...')
-                time.sleep(wait_interval)
-        self.logger.debug('run: end')
+                    skipped += 1
+                self.last_id = row[0]
+                count += 1
+            # time spent reading rows from the server, net of formatting and callbacks
+            self.stats.observe('fetch', time.perf_counter() - query_start - self.format_time - self.callback_time)
+            if newest is None and self.batch_size and count >= self.batch_size:
+                # reading a backlog, with no probe to say how far it goes
+                newest = self.get_last_row_id()
+        except self.db.connection_errors as exc:
+            # the next poll resumes after last_id, the last row output
+            self.logger.warning(f"Connection lost: {exc}; reconnecting")
+            self.db.recover()
+            return count
+        except self.db.query_errors:
+            if self.schema_cache:
+                # the table may have changed under the cached columns
+                self.schema_cache.invalidate(self.schema_key)
+            raise
+        finally:
+            self.flush()
+            self.record_poll(start, count - skipped, row)
+            if skipped:
+                self.stats.count('filtered', skipped)
+        # after a full batch there may be more rows, so the next poll skips the probe
+        self.backlog = bool(self.batch_size) and count >= self.batch_size
+        if self.end_id is not None and (not self.backlog or self.last_id >= self.end_id):
+            self.logger.info(f"{self.table}: reached the end of the time window at id {self.end_id}")
+            self.last_id = max(self.last_id, self.end_id)
+            self.running = False
+        if not self.backlog:
+            self.probe_id = max(self.probe_id, self.last_id, self.last_id if newest is None else newest)
+        self.newest_id = max(self.newest_id or 0, self.last_id, newest or 0)
+        if count and self.checkpoint and output == self.output_row:
+            # rows the where filter skipped advance last_id too, so a restart does not read them again
+            self.checkpoint.update(self.last_id)
+        if count:
+            self.logger.debug(f"{count} row{'' if count==1 else 's'} returned")
+        return count
+
+    def record_poll(self, start, count, row):
+        """record the stage timings of a poll which output count rows, the last of them row"""
+        if count:
+            self.stats.count('rows', count)
+            self.stats.observe('format', self.format_time)
+            self.stats.observe('callbacks', self.callback_time)
+            if self.lag_index is not None:
+                self.observe_lag(row[self.lag_index])
+        else:
+            self.stats.count('empty_polls')
+        self.stats.observe('poll', time.perf_counter() - start)
+
+    def observe_lag(self, value):
+        if isinstance(value, datetime.datetime):
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if value.tzinfo is None:
+                now = now.replace(tzinfo=None)
+            self.stats.observe('lag', max(0, (now - value).total_seconds()))
+
+    def next_wait(self, count):
+        """return the seconds to wait before the next poll"""
+        wait = self.scheduler.next_wait(count, bool(self.batch_size) and count >= self.batch_size)
+        self.logger.debug(f"{count} rows; next poll in {wait:.3f}s")
+        return wait
+
+    def get_stats(self):
+        """return counters and per-poll stage latencies for this tail and its database connection"""
+        return dict(
+            table=self.table,
+            last_id=getattr(self, 'last_id', None),
+            tail=self.stats.snapshot(),
+            db=self.db.stats.snapshot(),
+            scheduler=self.scheduler.stats(),
+            probe=dict(probe=self.probe, newest_id=self.get_newest_seen(), probes=self.probes, skipped=self.probes_skipped)
+        )
+
+    def get_newest_seen(self):
+        """return the newest row id seen by the probe, a backlog poll or the tail query, never less than last_id"""
+        last_id = getattr(self, 'last_id', None)
+        if self.newest_id is None or last_id is None:
+            return self.newest_id
+        return max(self.newest_id, last_id)
+
+    def stop(self):
+        """flush the last partial batch, close the cursors and save the checkpoint"""
+        self.running = False
+        try:
+            self.flush()
+        finally:
+            # a batch callback which fails leaves the checkpoint at the last batch written
+            self.close_cursors()
+            if self.checkpoint:
+                self.checkpoint.close()
 
     def sql_where(self, where=None):
-        ret = copy.copy(self.filters)
-        if where:
-            ret.append(where)
-        return f"{'WHERE ' if ret else ''}{' AND '.join(ret)}"
+        clause = ' AND '.join(c for c in (self.sql_filter, where) if c)
+        return f"WHERE {clause}" if clause else ''
 
-    def get_new_rows(self, cursor, last_id):
-        where = self.sql_where(f"id > {last_id}")
-        rows = cursor.query(f"SELECT id as _id,{self.sql_fields} FROM {self.table} {where} ORDER BY id;")
-        return rows
+    def prepared_cursor(self, name):
+        """return the named prepared cursor, recreating it if the connection has been reestablished"""
+        generation, cursor = self.cursors.get(name, (None, None))
+        if cursor is None or generation != self.db.generation:
+            # statements do not survive a reconnect, so the old cursor is simply dropped
+            cursor = self.db.cursor(prepared=True, tuple=True)
+            self.cursors[name] = (self.db.generation, cursor)
+        return cursor
+
+    def close_cursors(self):
+        for generation, cursor in self.cursors.values():
+            if generation == self.db.generation and self.db.cxn:
+                cursor.close()
+        self.cursors = {}
+
+    def get_newest_id(self):
+        """return the newest row id in the table, by the configured probe"""
+        self.probes += 1
+        rows = self.prepared_cursor('probe').query(self.sql_probe, self.probe_params)
+        return rows[0][0] if rows else None
+
+    def get_new_rows(self, last_id):
+        """yield up to batch_size rows with id greater than last_id, up to end_id if set, as tuples of _id and the field values"""
+        if self.end_id is not None:
+            return self.prepared_cursor('range').iterate(self.sql_range, (last_id, self.end_id))
+        return self.prepared_cursor('tail').iterate(self.sql_tail, (last_id,))
 
     def get_last_row_id(self):
-        with self.db.cursor() as cursor:
-            rows = cursor.query(f"SELECT id from {self.table} {self.sql_where()} ORDER BY id DESC LIMIT 1;")
-        return rows[0].id
+        # the filters are left out: rows between the last match and the end of
+        # the table would not be output anyway, and MAX(id) reads only the index
+        with self.db.cursor(tuple=True) as cursor:
+            rows = cursor.query(f"SELECT MAX(id) FROM {self.table};")
+        return rows[0][0] or 0
 
     def output_rows(self, rows):
-        for msg in map(self.format_row, rows):
-            for callback in self.callbacks:
-                callback(msg)
+        predicate = self.predicate
+        for row in rows:
+            if predicate is None or predicate(row):
+                self.output_row(row)
+
+    def output_row(self, row):
+        start = time.perf_counter()
+        msg = self.encode(row)
+        formatted = time.perf_counter()
+        for callback in self.callbacks:
+            callback(msg)
+        self.format_time += formatted - start
+        self.callback_time += time.perf_counter() - formatted
+        self.stats.count('bytes_out', len(msg))
+        if self.batch_callbacks:
+            # batched rows are checkpointed when the batch is flushed
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append(msg)
+            self.pending_id = row[0]
+            if time.monotonic() - self.pending_since >= self.flush_latency:
+                self.flush()
+        elif self.checkpoint:
+            self.checkpoint.update(row[0])
+
+    def flush(self):
+        """pass the pending batch of formatted rows to each batch callback"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        start = time.perf_counter()
+        for callback in self.batch_callbacks:
+            callback(batch)
+        self.stats.observe('flush', time.perf_counter() - start)
+        if self.checkpoint:
+            self.checkpoint.update(self.pending_id)
 
     def format_row(self, row):
-        return self.delimiter.join([self.fields[k].fmt(v) for k,v in row.items() if k in self.fields])
-        line = []
-        for k,v in row.items():
-            if k in self.fields:
-                field = self.fields[k]
-                func = field.fmt
-                text = func(v)
-                line.append(text)
-        msg = self.delimiter.join(line)
-        return msg
+        """format a tail row tuple, or a Row dict keyed by field name"""
+        if isinstance(row, dict):
+            return self.format_dict(row)
+        return self.format_tuple(row)
 
 
 class Field():
@@ -170,6 +513,10 @@ class Field():
                 tz=self.tz
             )
 
+    def sql_where(self):
+        """return where_clause with {name} replaced by the column name"""
+        return self.where_clause.replace('{name}', self.name)
+
     def init_fmt_func(self, fmt_func, name, type_hint):
         if fmt_func:
             if isinstance(fmt_func, str):
@@ -183,7 +530,16 @@ class Field():
                 fmt = self.fmt_str
         return fmt
 
+    def compile(self):
+        """return a standalone function equivalent to fmt, specialized for this field's options"""
+        if self.fmt == self.fmt_datetime:
+            return DatetimeFormatter(self.tz)
+        if self.fmt == self.fmt_str:
+            return compile_str(self.lpad, self.rpad, self.truncate)
+        return self.fmt
+
     def fmt_datetime(self, dt):
+        import arrow
         return arrow.get(dt).to(self.tz).isoformat(' ')[:24]
 
     def fmt_str(self, value):
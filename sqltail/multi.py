@@ -0,0 +1,128 @@
+# sqltail multi-table
+
+import logging
+import threading
+import time
+
+from sqltail.monitor import SQLTail
+
+
+class MultiTail():
+    """
+    Tail several tables from one process.
+
+    tables is either a list of table names, or a dict mapping each table name
+    to its own SQLTail keyword arguments, for example:
+
+        {"log": {"fields": ["timestamp", "message"], "filters": ['level="ERROR"']}, "events": {}}
+
+    A list value is taken as the table's fields.  Tables are spread over a pool
+    of `workers` connections cloned from db; each worker thread polls its tables
+    in turn, sleeping until the next one is due.  Output from all tables goes to
+    the same callbacks, serialized by a lock, with the table name included in
+    each record when tag is set.  batch_callbacks receive lists of rows as
+    SQLTail's do.
+    """
+
+    def __init__(self, db, tables, workers=1, callbacks=[print], batch_callbacks=[], tag=True, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.callbacks = callbacks
+        self.batch_callbacks = batch_callbacks
+        self.tag = tag
+        self.lock = threading.Lock()
+        self.running = False
+        self.errors = []
+        if not isinstance(tables, dict):
+            tables = {table: {} for table in tables}
+        workers = max(1, min(workers, len(tables)))
+        self.pool = [db] + [db.clone() for _ in range(workers - 1)]
+        self.tails = []
+        for i, (table, spec) in enumerate(tables.items()):
+            if isinstance(spec, list):
+                spec = dict(fields=spec)
+            options = dict(kwargs)
+            options.update(spec)
+            db = self.pool[i % len(self.pool)]
+            callbacks = [self.make_callback()] if self.callbacks else []
+            batch_callbacks = [self.make_batch_callback()] if self.batch_callbacks else []
+            self.tails.append(SQLTail(db, table=table, callbacks=callbacks, batch_callbacks=batch_callbacks, tag=tag, **options))
+        self.logger.debug(f"{self}")
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{len(self.pool)} {[t.table for t in self.tails]}>"
+
+    def make_callback(self):
+        def callback(msg):
+            with self.lock:
+                for func in self.callbacks:
+                    func(msg)
+        return callback
+
+    def make_batch_callback(self):
+        def callback(batch):
+            with self.lock:
+                for func in self.batch_callbacks:
+                    func(batch)
+        return callback
+
+    def get_field_template(self):
+        return {tail.table: tail.get_field_template() for tail in self.tails}
+
+    def get_columns(self):
+        return {tail.table: tail.columns for tail in self.tails}
+
+    def get_stats(self):
+        return [tail.get_stats() for tail in self.tails]
+
+    def run(self, timeout=None):
+        self.logger.debug('run: begin')
+        self.running = True
+        deadline = time.monotonic() + timeout if timeout else None
+        threads = []
+        for db in self.pool:
+            tails = [tail for tail in self.tails if tail.db is db]
+            thread = threading.Thread(target=self.run_worker, args=(tails, deadline), daemon=True)
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.running = False
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            self.running = False
+        if self.errors:
+            raise self.errors[0]
+        self.logger.debug('run: end')
+
+    def run_worker(self, tails, deadline):
+        """poll each of tails on this worker's connection when it is due"""
+        try:
+            for tail in tails:
+                tail.start()
+                tail.catch_up()
+            due = {tail: 0 for tail in tails}
+            while self.running and any(tail.running for tail in tails):
+                idle = True
+                for tail in tails:
+                    # a tail stops at the end of its time window
+                    if tail.running and due[tail] <= time.monotonic():
+                        count = tail.poll()
+                        due[tail] = time.monotonic() + tail.next_wait(count)
+                        idle = idle and not count
+                if idle and deadline and time.monotonic() > deadline:
+                    break
+                # the tails of a worker share its connection; a change signalled by the server makes them all due
+                if tails[0].db.wait(max(0, min(due.values()) - time.monotonic())):
+                    due = dict.fromkeys(due, 0)
+        except Exception as exc:
+            self.logger.error(f"worker failed: {exc}")
+            self.errors.append(exc)
+            self.running = False
+        finally:
+            for tail in tails:
+                tail.stop()
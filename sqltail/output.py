@@ -0,0 +1,177 @@
+# sqltail output
+
+import csv
+import datetime
+import decimal
+import io
+import json
+import sys
+
+from sqltail.formatter import DatetimeFormatter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OUTPUT_FORMATS = ['text', 'ndjson', 'csv', 'msgpack']
+
+
+class BatchWriter():
+    """
+    A SQLTail batch callback writing each batch of lines to a stream with
+    a single write and flush, instead of one write per row.  With binary,
+    the batch is a list of bytes records written back to back to the
+    stream's underlying binary buffer.
+    """
+
+    def __init__(self, stream=None, binary=False):
+        self.stream = stream or sys.stdout
+        self.binary = binary
+        if binary:
+            self.stream = getattr(self.stream, 'buffer', self.stream)
+
+    def __call__(self, lines):
+        if self.binary:
+            data = b''.join(lines)
+        else:
+            data = '\n'.join(lines) + '\n'
+        self.stream.write(data)
+        self.stream.flush()
+
+
+def to_jsonable(value):
+    """convert values the json encoders do not handle natively"""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode(errors='replace')
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"{type(value).__name__} is not serializable")
+
+
+if orjson:
+    def dumps(obj):
+        return orjson.dumps(obj, default=to_jsonable).decode()
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=to_jsonable, ensure_ascii=False, separators=(',', ':'))
+
+
+class Encoder():
+    """
+    Encode tail rows (tuples of _id and the field values) for output.
+
+    The text encoder uses the tail's Field formatting; the structured
+    encoders work on the typed values, converting only datetime fields
+    (to ISO 8601 in the field's timezone).  With tag, the table name is
+    included in each record.  With events, records carry the binlog event
+    which produced them, passed to encode() for updates and deletes.
+    """
+
+    binary = False
+
+    def __init__(self, tail, tag=False, events=False):
+        self.tail = tail
+        self.tag = tag
+        self.events = events
+        self.names = list(tail.fields)
+        self.converters = []
+        for field in tail.fields.values():
+            if field.fmt == field.fmt_datetime:
+                formatter = DatetimeFormatter(field.tz)
+                self.converters.append(lambda v, f=formatter: f.isoformat(v) if isinstance(v, datetime.datetime) else v)
+            else:
+                self.converters.append(None)
+
+    def values(self, row):
+        return [v if convert is None or v is None else convert(v) for convert, v in zip(self.converters, row[1:])]
+
+    def record(self, row, event):
+        ret = {}
+        if self.tag:
+            ret['_table'] = self.tail.table
+        if self.events:
+            ret['_event'] = event or 'insert'
+        ret.update(zip(self.names, self.values(row)))
+        return ret
+
+
+class TextEncoder(Encoder):
+
+    def __init__(self, tail, tag=False, events=False):
+        self.tail = tail
+        self.prefix = f"{tail.table}{tail.delimiter}" if tag else ''
+
+    def encode(self, row, event=None):
+        msg = self.tail.format_row(row)
+        if event:
+            msg = f"{event}{self.tail.delimiter}{msg}"
+        return self.prefix + msg if self.prefix else msg
+
+
+class NDJSONEncoder(Encoder):
+
+    def encode(self, row, event=None):
+        return dumps(self.record(row, event))
+
+
+class CSVEncoder(Encoder):
+    """one csv record per line; the first line output is a header of the column names"""
+
+    def __init__(self, tail, tag=False, events=False):
+        super().__init__(tail, tag, events)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='')
+        self.header = (['_table'] if tag else []) + (['_event'] if events else []) + self.names
+
+    def line(self, values):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerow(values)
+        return self.buffer.getvalue()
+
+    def encode(self, row, event=None):
+        values = self.values(row)
+        if self.events:
+            values.insert(0, event or 'insert')
+        if self.tag:
+            values.insert(0, self.tail.table)
+        ret = self.line(values)
+        if self.header:
+            ret = self.line(self.header) + '\n' + ret
+            self.header = None
+        return ret
+
+
+class MsgpackEncoder(Encoder):
+    """a stream of msgpack maps"""
+
+    binary = True
+
+    def __init__(self, tail, tag=False, events=False):
+        try:
+            import msgpack
+        except ImportError as exc:
+            raise ImportError('msgpack output requires the msgpack package') from exc
+        super().__init__(tail, tag, events)
+        self.packer = msgpack.Packer(default=to_jsonable)
+
+    def encode(self, row, event=None):
+        return self.packer.pack(self.record(row, event))
+
+
+ENCODERS = dict(text=TextEncoder, ndjson=NDJSONEncoder, csv=CSVEncoder, msgpack=MsgpackEncoder)
+
+
+def make_encoder(output_format, tail, tag=False, events=False):
+    try:
+        cls = ENCODERS[output_format]
+    except KeyError:
+        raise ValueError(f"unknown output format {output_format}; expected one of {', '.join(OUTPUT_FORMATS)}") from None
+    return cls(tail, tag, events)
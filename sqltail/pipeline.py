@@ -0,0 +1,173 @@
+# sqltail multiprocess pipeline
+
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+from sqltail.formatter import compile_formatter
+from sqltail.monitor import Field
+from sqltail.output import make_encoder
+
+PROCESSES=2
+CHUNK_SIZE=500
+QUEUE_DEPTH=4
+
+# the encoder of a pipeline process, set by init_process()
+_encoder = None
+
+
+class RowFormatter():
+    """the parts of a SQLTail an Encoder uses, rebuilt in a pipeline process from its field templates"""
+
+    def __init__(self, table, templates, delimiter):
+        self.table = table
+        self.delimiter = delimiter
+        self.fields = {template['name']: Field(**template) for template in templates}
+        funcs = [field.compile() for field in self.fields.values()]
+        self.format_row = compile_formatter(funcs, delimiter, offset=1)
+
+
+def init_process(table, templates, delimiter, output_format, tag):
+    global _encoder
+    formatter = RowFormatter(table, templates, delimiter)
+    _encoder = make_encoder(output_format, formatter, tag)
+    # the writer emits the csv header once, not each process
+    _encoder.header = None
+
+
+def encode_rows(rows):
+    return [_encoder.encode(row) for row in rows]
+
+
+class Pipeline():
+    """
+    Run a SQLTail with row formatting and encoding spread over a pool of
+    processes.
+
+    The calling thread polls the tail, cutting the rows of each poll into
+    chunks of chunk_size which are encoded in the pool.  A writer thread
+    takes the results in submission order, passes them to the tail's
+    callbacks and batch callbacks and updates the checkpoint, so output is
+    ordered exactly as SQLTail.run() would produce it.  At most
+    queue_depth chunks per process are in flight; when the writer falls
+    behind, polling waits for it.
+
+    Each process rebuilds the fields from their templates, so fields
+    must use the built in format functions.
+    """
+
+    def __init__(self, tail, processes=PROCESSES, chunk_size=CHUNK_SIZE, queue_depth=QUEUE_DEPTH):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tail = tail
+        self.processes = max(1, processes)
+        self.chunk_size = chunk_size
+        self.templates = tail.get_field_template()
+        for template in self.templates:
+            if not hasattr(Field, template['format_func']):
+                raise ValueError(f"field {template['name']} format function {template['format_func']} cannot be used in a pipeline process")
+        self.queue = queue.Queue(maxsize=self.processes * queue_depth)
+        self.pool = None
+        self.writer = None
+        self.errors = []
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.tail.table} {self.processes} {self.chunk_size}>"
+
+    def start(self):
+        tail = self.tail
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.processes, initializer=init_process,
+            initargs=(tail.table, self.templates, tail.delimiter, tail.output_format, tail.tag)
+        )
+        self.writer = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer.start()
+        tail.start()
+        tail.catch_up()
+        return self
+
+    def run(self, timeout=None):
+        self.logger.debug('run: begin')
+        deadline = time.monotonic() + timeout if timeout else None
+        self.start()
+        try:
+            while self.tail.running:
+                count = self.poll()
+                wait = self.tail.next_wait(count)
+                if not count and deadline and time.monotonic() > deadline:
+                    self.logger.debug('Timeout')
+                    break
+                if wait:
+                    self.tail.db.wait(wait)
+        finally:
+            self.stop()
+        self.logger.debug('run: end')
+
+    def poll(self):
+        """poll the tail and submit its rows for encoding, returning the number of rows"""
+        rows = []
+        count = self.tail.poll(rows.append)
+        for i in range(0, len(rows), self.chunk_size):
+            chunk = rows[i:i + self.chunk_size]
+            self.put((self.pool.submit(encode_rows, chunk), chunk[-1][0]))
+        return count
+
+    def put(self, item):
+        """queue item for the writer, waiting for room; raises the writer's exception if it has failed"""
+        while True:
+            if self.errors:
+                raise self.errors[0]
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def stop(self):
+        """output everything submitted and shut down the pool"""
+        if self.writer:
+            if self.writer.is_alive():
+                self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+        self.tail.stop()
+        if self.errors:
+            raise self.errors[0]
+
+    def run_writer(self):
+        tail = self.tail
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                future, last_id = item
+                lines = future.result()
+                header = getattr(tail.encoder, 'header', None)
+                if header:
+                    # the tail's own encoder has not output the csv header yet
+                    lines[0] = tail.encoder.line(header) + '\n' + lines[0]
+                    tail.encoder.header = None
+                start = time.perf_counter()
+                for msg in lines:
+                    for callback in tail.callbacks:
+                        callback(msg)
+                for callback in tail.batch_callbacks:
+                    callback(lines)
+                tail.stats.observe('flush', time.perf_counter() - start)
+                tail.stats.count('bytes_out', sum(len(msg) for msg in lines))
+                if tail.checkpoint:
+                    tail.checkpoint.update(last_id)
+        except Exception as exc:
+            self.logger.error(f"writer failed: {exc}")
+            self.errors.append(exc)
+            # unblock a poll waiting for room
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
@@ -0,0 +1,116 @@
+# sqltail poll scheduling
+
+import logging
+import random
+import time
+
+WAIT_INTERVAL_INIT=0.1
+WAIT_INTERVAL_MULTIPLIER=2
+WAIT_INTERVAL_MAX=1
+JITTER=0
+RATE_SMOOTHING=0.3
+
+
+class Scheduler():
+    """
+    Decide how long a tail waits between polls.
+
+    After a poll returns rows the next poll is immediate; each empty poll
+    multiplies the wait by backoff, from min_interval up to max_interval.
+    jitter randomizes each wait by up to that fraction, so tails started
+    together do not poll the server in lockstep.
+    """
+
+    name = 'backoff'
+
+    def __init__(self, min_interval=WAIT_INTERVAL_INIT, max_interval=WAIT_INTERVAL_MAX, backoff=WAIT_INTERVAL_MULTIPLIER, jitter=JITTER):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = self.min_interval
+        self.polls = 0
+        self.empty_polls = 0
+        self.last_wait = 0
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.min_interval} {self.max_interval} {self.backoff} {self.jitter}>"
+
+    def next_wait(self, count, full=False):
+        """return the seconds to wait after a poll which returned count rows (full if the batch limit was hit)"""
+        self.polls += 1
+        if not count:
+            self.empty_polls += 1
+        wait = self.next_interval(count, full)
+        if wait and self.jitter:
+            wait *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.last_wait = wait
+        return wait
+
+    def next_interval(self, count, full):
+        if count:
+            self.interval = self.min_interval
+            return 0
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    def stats(self):
+        return dict(
+            scheduler=self.name,
+            polls=self.polls,
+            empty_polls=self.empty_polls,
+            interval=self.interval,
+            last_wait=self.last_wait,
+        )
+
+
+class AdaptiveScheduler(Scheduler):
+    """
+    Schedule polls from the table's observed insert rate.
+
+    The rate is a moving average of rows per second between polls.  While
+    rows are arriving the wait is the expected time until the next row,
+    so busy tables are polled at min_interval and quiet ones less often;
+    a full batch is followed immediately by the next one.  Empty polls
+    back off towards max_interval and decay the rate estimate.
+    """
+
+    name = 'adaptive'
+
+    def __init__(self, *args, smoothing=RATE_SMOOTHING, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.smoothing = smoothing
+        self.rate = 0.0
+        self.last_poll = None
+
+    def next_interval(self, count, full):
+        now = time.monotonic()
+        if self.last_poll is not None and now > self.last_poll:
+            sample = count / (now - self.last_poll)
+            self.rate += self.smoothing * (sample - self.rate)
+        self.last_poll = now
+        if full:
+            self.interval = self.min_interval
+            return 0
+        if count:
+            expected = 1 / self.rate if self.rate else self.max_interval
+            self.interval = max(self.min_interval, min(expected, self.max_interval))
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    def stats(self):
+        ret = super().stats()
+        ret['rate'] = round(self.rate, 3)
+        return ret
+
+
+SCHEDULERS = {cls.name: cls for cls in (Scheduler, AdaptiveScheduler)}
+
+
+def make_scheduler(name='backoff', **kwargs):
+    try:
+        return SCHEDULERS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"unknown scheduler {name}; expected one of {', '.join(SCHEDULERS)}") from None
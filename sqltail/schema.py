@@ -0,0 +1,69 @@
+# sqltail schema cache
+
+import json
+import logging
+import pathlib
+import threading
+import time
+
+from sqltail.checkpoint import write_json
+from sqltail.db import Row
+
+SCHEMA_TTL=3600
+
+# serializes read-modify-write of cache files shared by tails in one process
+_lock = threading.Lock()
+
+
+class SchemaCache():
+    """
+    Keep the columns of tailed tables in a json file, so a tail started
+    again can skip introspecting the table.
+
+    Entries are keyed by the server, database and table, and stored with
+    the backend's schema fingerprint (SQLite's schema_version): an entry is
+    used while the fingerprint matches.  Backends without a cheap
+    fingerprint get None, and their entries are used for ttl seconds.  A
+    tail invalidates its entry when its query fails, for example on a
+    dropped column.
+    """
+
+    def __init__(self, path, ttl=SCHEMA_TTL):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = pathlib.Path(path).expanduser()
+        self.ttl = ttl
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.path} {self.ttl}>"
+
+    @staticmethod
+    def make_key(db, table):
+        return f"{db.name}://{db.host}:{db.port}/{db.database}/{table}"
+
+    def read(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, key, fingerprint=None):
+        """return the cached columns for key as Rows, or None if missing or stale"""
+        entry = self.read().get(key)
+        if not entry or entry['fingerprint'] != fingerprint:
+            return None
+        if fingerprint is None and time.time() - entry['saved'] > self.ttl:
+            return None
+        self.logger.debug(f"{self} hit {key}")
+        return [Row(column) for column in entry['columns']]
+
+    def put(self, key, fingerprint, columns):
+        with _lock:
+            data = self.read()
+            data[key] = dict(fingerprint=fingerprint, saved=time.time(), columns=[dict(column) for column in columns])
+            write_json(self.path, data)
+
+    def invalidate(self, key):
+        with _lock:
+            data = self.read()
+            if data.pop(key, None) is not None:
+                write_json(self.path, data)
@@ -0,0 +1,350 @@
+# sqltail tail server
+
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from sqltail.filters import compile_filter
+from sqltail.monitor import SQLTail
+from sqltail.pipeline import RowFormatter
+from sqltail.output import make_encoder
+
+# batches of rows queued for a subscriber before it is disconnected as too slow
+SUBSCRIBER_QUEUE=1024
+
+# seconds a write to a subscriber may block before it is disconnected as not reading
+SEND_TIMEOUT=10
+
+
+def parse_address(address):
+    """return the socket family and address for HOST:PORT, or the path of a unix socket"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+def compile_match(match, names):
+    """
+    Return a predicate over tail rows (tuples of _id and the values of the
+    fields names) which is true when each field named in match has one of
+    its values, compared as strings, or None if match is empty.
+    """
+    tests = []
+    for name, values in (match or {}).items():
+        if name not in names:
+            raise ValueError(f"cannot match {name}; expected one of {', '.join(names)}")
+        values = values if isinstance(values, list) else [values]
+        tests.append((names.index(name) + 1, set(str(value) for value in values)))
+    if not tests:
+        return None
+    return lambda row: all(str(row[i]) in values for i, values in tests)
+
+
+class Subscriber():
+    """
+    A client of a TailServer: its fields, filter and output format applied
+    to the rows of one table's tail.
+
+    fields is a list of field names, or field templates as --get-template
+    outputs them; names take the tail's formatting, with tz if given.
+    where is a filter expression (see sqltail.filters) over the tail's
+    fields, applied with match.  The poller passes each poll's rows to
+    put(); they are queued until the subscriber's connection thread encodes
+    and sends them, so a slow client does not hold up the poll.  A client
+    which lets queue_size batches accumulate is dropped.
+    """
+
+    def __init__(self, tail, fields=None, match=None, output_format='text', tz=None, where=None, queue_size=SUBSCRIBER_QUEUE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.table = tail.table
+        names = tail.row_names
+        templates = {field['name']: field for field in tail.get_field_template()}
+        if not fields:
+            fields = list(tail.fields)
+        elif isinstance(fields, str):
+            fields = fields.split(',')
+        specs = []
+        for field in fields:
+            spec = dict(field) if isinstance(field, dict) else dict(templates.get(field, dict(name=field)))
+            if spec['name'] not in templates:
+                raise ValueError(f"{self.table} has no field {spec['name']}")
+            if tz and not isinstance(field, dict):
+                spec['tz'] = tz
+            specs.append(spec)
+        self.fields = [spec['name'] for spec in specs]
+        self.index = [0] + [names.index(name) + 1 for name in self.fields]
+        tests = [test for test in (compile_match(match, names), compile_filter(where, names) if where else None) if test]
+        if len(tests) == 2:
+            self.predicate = lambda row: tests[0](row) and tests[1](row)
+        else:
+            self.predicate = tests[0] if tests else None
+        self.encoder = make_encoder(output_format, RowFormatter(self.table, specs, tail.delimiter))
+        self.queue = queue.Queue(queue_size)
+        self.overflow = False
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.table} {self.fields}>"
+
+    def put(self, rows):
+        """queue a batch of tail rows, or None to end the subscription"""
+        try:
+            self.queue.put_nowait(rows)
+        except queue.Full:
+            self.logger.warning(f"{self} is not keeping up; disconnecting")
+            self.overflow = True
+
+    def encode(self, rows):
+        """return the bytes sent for the rows of a batch which pass the filter"""
+        if self.predicate:
+            rows = [row for row in rows if self.predicate(row)]
+        if not rows:
+            return b''
+        index = self.index
+        lines = [self.encoder.encode(tuple(row[i] for i in index)) for row in rows]
+        if self.encoder.binary:
+            return b''.join(lines)
+        return ('\n'.join(lines) + '\n').encode()
+
+
+class SubscriberHandler(socketserver.StreamRequestHandler):
+    """
+    Read the client's subscription request, a json object on one line, and
+    reply with a json line describing the subscription, or an error, then
+    stream the encoded rows until either side disconnects.  A client which
+    lets its queue overflow, or stops reading for the server's send_timeout
+    seconds, is disconnected.
+    """
+
+    def handle(self):
+        tail_server = self.server.tail_server
+        try:
+            request = json.loads(self.rfile.readline() or 'null')
+            subscriber = tail_server.subscribe(request)
+        except (ValueError, TypeError, AttributeError) as exc:
+            self.send_json(dict(error=str(exc)))
+            return
+        try:
+            self.send_json(dict(table=subscriber.table, fields=subscriber.fields))
+            self.connection.settimeout(tail_server.send_timeout)
+            while not subscriber.overflow:
+                rows = subscriber.queue.get()
+                if rows is None:
+                    break
+                try:
+                    data = subscriber.encode(rows)
+                except Exception as exc:
+                    tail_server.logger.error(f"{subscriber} failed to encode rows: {exc}; disconnecting")
+                    break
+                if data:
+                    self.wfile.write(data)
+        except socket.timeout:
+            tail_server.logger.warning(f"{subscriber} stopped reading; disconnecting")
+        except OSError as exc:
+            tail_server.logger.debug(f"{subscriber} disconnected: {exc}")
+        finally:
+            tail_server.unsubscribe(subscriber)
+
+    def send_json(self, data):
+        self.wfile.write((json.dumps(data) + '\n').encode())
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TailServer():
+    """
+    Serve the rows of one SQLTail poller per table to any number of local
+    clients, so the database sees the same queries however many people are
+    watching.
+
+    tables is a list of table names or a dict of SQLTail keyword arguments
+    per table, as for MultiTail; the server's tails normally output every
+    column, and any filters given to them apply to all subscribers.  Each
+    table is polled by its own thread and connection.  Clients connect to
+    address, a unix socket path or HOST:PORT, and subscribe with a json
+    line naming the table, fields, filters and output_format (see attach()).
+    Rows are filtered and formatted for each subscriber in its connection
+    thread, off the poll loop.
+    """
+
+    send_timeout = SEND_TIMEOUT
+
+    def __init__(self, db, tables, address, **kwargs):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.address = address
+        if not isinstance(tables, dict):
+            tables = {table: {} for table in tables}
+        self.tails = []
+        for i, (table, spec) in enumerate(tables.items()):
+            if isinstance(spec, list):
+                spec = dict(fields=spec)
+            options = dict(kwargs)
+            options.update(spec)
+            self.tails.append(SQLTail(db if i == 0 else db.clone(), table=table, callbacks=[], batch_callbacks=[], **options))
+        self.subscribers = {tail.table: [] for tail in self.tails}
+        self.lock = threading.Lock()
+        self.running = False
+        self.errors = []
+        self.listener = None
+        self.logger.debug(f"{self}")
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.address} {[t.table for t in self.tails]}>"
+
+    def subscribe(self, request):
+        """add a Subscriber for a request, raising ValueError if it is invalid"""
+        if not isinstance(request, dict):
+            raise ValueError('expected a json object subscription request')
+        table = request.get('table') or (self.tails[0].table if len(self.tails) == 1 else 'log')
+        tails = {tail.table: tail for tail in self.tails}
+        if table not in tails:
+            raise ValueError(f"table {table} is not served; expected one of {', '.join(tails)}")
+        subscriber = Subscriber(tails[table], request.get('fields'), request.get('match'), request.get('output_format') or 'text', request.get('tz'), request.get('where'))
+        with self.lock:
+            self.subscribers[table].append(subscriber)
+        self.logger.info(f"subscribed {subscriber}")
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers[subscriber.table]:
+                self.subscribers[subscriber.table].remove(subscriber)
+                self.logger.info(f"unsubscribed {subscriber}")
+
+    def publish(self, table, rows):
+        with self.lock:
+            subscribers = list(self.subscribers[table])
+        for subscriber in subscribers:
+            subscriber.put(rows)
+
+    def get_stats(self):
+        stats = [tail.get_stats() for tail in self.tails]
+        with self.lock:
+            for item in stats:
+                item['subscribers'] = len(self.subscribers[item['table']])
+        return stats
+
+    def start(self):
+        """listen for subscribers"""
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            # a socket file left by a server which did not shut down cleanly
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+            self.listener = ThreadingUnixServer(address, SubscriberHandler)
+        else:
+            self.listener = ThreadingTCPServer(address, SubscriberHandler)
+        self.listener.tail_server = self
+        threading.Thread(target=self.listener.serve_forever, daemon=True).start()
+        self.logger.info(f"{self} listening")
+        return self
+
+    def stop(self):
+        """end the subscriptions and close the listener"""
+        self.running = False
+        with self.lock:
+            subscribers = [s for table in self.subscribers.values() for s in table]
+        for subscriber in subscribers:
+            subscriber.put(None)
+        if self.listener:
+            self.listener.shutdown()
+            self.listener.server_close()
+            if self.listener.address_family == socket.AF_UNIX:
+                os.unlink(self.listener.server_address)
+            self.listener = None
+
+    def run(self, timeout=None):
+        self.logger.debug('run: begin')
+        self.running = True
+        deadline = time.monotonic() + timeout if timeout else None
+        self.start()
+        threads = [threading.Thread(target=self.run_poller, args=(tail, deadline), daemon=True) for tail in self.tails]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.running = False
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            self.stop()
+        if self.errors:
+            raise self.errors[0]
+        self.logger.debug('run: end')
+
+    def run_poller(self, tail, deadline):
+        """poll tail and publish each poll's rows until stopped or past deadline"""
+        try:
+            tail.start()
+            while self.running and tail.running:
+                rows = []
+                count = tail.poll(rows.append)
+                if rows:
+                    self.publish(tail.table, rows)
+                # includes rows the tail's where filter skipped
+                if count and tail.checkpoint:
+                    tail.checkpoint.update(tail.last_id)
+                wait = tail.next_wait(count)
+                if not count and deadline and time.monotonic() > deadline:
+                    break
+                if wait:
+                    tail.db.wait(wait)
+        except Exception as exc:
+            self.logger.error(f"poller for {tail.table} failed: {exc}")
+            self.errors.append(exc)
+            self.running = False
+        finally:
+            tail.stop()
+
+
+def attach(address, request, stream, timeout=None):
+    """
+    Subscribe to the TailServer at address and write its output to the
+    binary stream until the server closes the connection, or for timeout
+    seconds.  request is a dict of the table, fields (names or templates),
+    match (a dict of field names to a value or list of values), where (a
+    filter expression), tz and output_format.  Raises ValueError if the
+    server rejects the request.
+    """
+    family, address = parse_address(address)
+    deadline = time.monotonic() + timeout if timeout else None
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall((json.dumps(request) + '\n').encode())
+        reader = sock.makefile('rb')
+        reply = json.loads(reader.readline() or 'null')
+        if not isinstance(reply, dict):
+            raise ConnectionError(f"no reply from {address}")
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        while True:
+            if deadline:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+            try:
+                data = reader.read1(65536)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            stream.write(data)
+            stream.flush()
@@ -0,0 +1,141 @@
+# sqltail stats
+
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+STATS_INTERVAL=10
+
+# histogram bucket i counts values up to MIN_LATENCY * 2**i seconds
+MIN_LATENCY=1e-6
+BUCKETS=36
+
+
+class Histogram():
+    """Latency histogram with power of two buckets from one microsecond, for cheap percentile estimates."""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        i = 0 if value <= MIN_LATENCY else min(BUCKETS - 1, math.ceil(math.log2(value / MIN_LATENCY)))
+        self.buckets[i] += 1
+
+    def percentile(self, p):
+        """return the upper bound of the bucket holding the p'th percentile"""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(MIN_LATENCY * 2 ** i, self.max)
+        return self.max
+
+    def snapshot(self):
+        return dict(
+            count=self.count,
+            mean=self.sum / self.count if self.count else None,
+            p50=self.percentile(50),
+            p90=self.percentile(90),
+            p99=self.percentile(99),
+            max=self.max,
+        )
+
+
+class Stats():
+    """
+    Counters and per-stage latency histograms.
+
+    Database keeps one for connection and statement execution, SQLTail one
+    for its poll loop; both are read through SQLTail.get_stats(), which the
+    stats reporter and metrics server call from their own threads.  New
+    counters and stages are added under lock, and snapshot() copies them
+    under it, so the poll loop only takes the lock the first time it
+    counts or times something.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+
+    def count(self, name, n=1):
+        try:
+            self.counters[name] += n
+        except KeyError:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.stages.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            counters = dict(self.counters)
+            stages = list(self.stages.items())
+        ret = dict(elapsed=round(elapsed, 3))
+        ret.update(counters)
+        for name in ('rows', 'polls', 'bytes_out'):
+            if name in counters:
+                ret[f"{name}_per_sec"] = round(counters[name] / elapsed, 3) if elapsed else None
+        if counters.get('polls'):
+            ret['empty_poll_ratio'] = round(counters.get('empty_polls', 0) / counters['polls'], 4)
+        ret['stages'] = {name: histogram.snapshot() for name, histogram in stages}
+        return ret
+
+
+class StatsReporter():
+    """
+    Write the stats of a tail (anything with get_stats()) as a json line
+    to a file, or stderr for '-', every interval seconds from a daemon thread.
+    """
+
+    def __init__(self, source, path='-', interval=STATS_INTERVAL):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.report()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        line = json.dumps(self.source.get_stats(), default=str) + '\n'
+        if self.path == '-':
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            with open(self.path, 'a') as ofp:
+                ofp.write(line)
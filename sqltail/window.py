@@ -0,0 +1,99 @@
+# sqltail time window
+
+import datetime
+import logging
+import re
+
+DURATION = re.compile(r'^(\d+(?:\.\d+)?)([smhdw])$')
+DURATION_UNITS = dict(s='seconds', m='minutes', h='hours', d='days', w='weeks')
+
+
+def parse_time(value, tz='UTC'):
+    """
+    Return the naive UTC datetime for value: a duration before now such as
+    90s, 15m, 2h, 1d or 1w, or an ISO 8601 time, taken in tz if it has no
+    utc offset.  Raises ValueError for anything else.  A datetime is
+    returned as by utc_naive(), so naive datetimes, including those
+    parse_time returns, are taken as UTC whatever tz is.
+    """
+    if isinstance(value, datetime.datetime):
+        return utc_naive(value)
+    match = DURATION.match(value.strip())
+    if match:
+        delta = datetime.timedelta(**{DURATION_UNITS[match.group(2)]: float(match.group(1))})
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - delta
+    try:
+        when = datetime.datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError(f"expected a duration like 15m or an ISO 8601 time, not {value!r}") from None
+    if when.tzinfo is None:
+        if tz in ('UTC', 'utc'):
+            return when
+        import arrow
+        return arrow.get(when, tzinfo=tz).to('UTC').naive
+    return when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def utc_naive(value):
+    """return a column value as a naive UTC datetime for comparison, or None"""
+    if value is None:
+        return None
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class TimeWindow():
+    """
+    Resolve a since/until time window of a tail to the ids bounding it.
+
+    Log tables are appended in time order, so the time column increases
+    with id, and the last id before a time is found by binary search on
+    id: each step is a seek on the primary key for the first row at or
+    after the middle id, so resolving a window takes about log2(max id)
+    single row queries whether or not the time column is indexed.  Naive
+    column values are taken as UTC; rows with no time are treated as old.
+    """
+
+    def __init__(self, tail, column, since=None, until=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tail = tail
+        self.column = column
+        self.since = since
+        self.until = until
+        self.queries = 0
+        param = tail.db.param
+        self.sql_seek = f"SELECT id, {column} FROM {tail.table} WHERE id >= {param} ORDER BY id LIMIT 1;"
+
+    def __str__(self):
+        return f"{self.__class__.__name__}<{self.tail.table} {self.column} {self.since} {self.until}>"
+
+    def resolve(self):
+        """return the id after which the window starts, and the last id in it, or None without until"""
+        with self.tail.db.cursor(tuple=True) as cursor:
+            high = self.tail.get_last_row_id()
+            start = self.id_before(cursor, self.since, high) if self.since else None
+            end = self.id_before(cursor, self.until, high) if self.until else None
+        self.logger.info(f"{self} resolved to ids ({start}, {end}] in {self.queries} queries")
+        return start, end
+
+    def id_before(self, cursor, when, high):
+        """return the id of the last row with a time before when, or 0 if there is none"""
+        # invariant: the answer is in [low, high], and row low (if any) is before when
+        low = 0
+        while low < high:
+            middle = (low + high + 1) // 2
+            rows = cursor.query(self.sql_seek, (middle,))
+            self.queries += 1
+            if not rows or rows[0][0] > high:
+                high = middle - 1
+                continue
+            row_id, value = rows[0]
+            value = utc_naive(value)
+            if value is not None and value >= when:
+                high = middle - 1
+            else:
+                low = row_id
+        return low
@@ -7,6 +7,8 @@ import json
 import logging
 import os
 import pytest
+import re
+import time
 
 RUN_TIME=int(os.environ.get('RUN_TIME', '1'))
 
@@ -64,3 +66,852 @@ def test_events():
     elapsed = (datetime.datetime.now() - start).seconds
     assert elapsed >= RUN_TIME
 
+
+def test_checkpoint(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    key = sqltail.Checkpoint.make_key('localhost', 3306, 'app_log', 'log', ['level="ERROR"'])
+    checkpoint = sqltail.Checkpoint(path, key, interval=60)
+    assert checkpoint.load() is None
+    checkpoint.update(10)
+    checkpoint.update(20)
+    checkpoint.close()
+    other = sqltail.Checkpoint(path, 'other', interval=0)
+    other.update(5)
+    assert json.loads(path.read_text()) == {key: 20, 'other': 5}
+    assert sqltail.Checkpoint(path, key).load() == 20
+
+def test_async(sqlite_log, tmp_path):
+    import asyncio
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], checkpoint=tmp_path / 'checkpoint.json')
+    received = []
+    gate = asyncio.Event()
+
+    async def callback(msg):
+        await gate.wait()
+        received.append(msg)
+
+    async def main():
+        tail = sqltail.AsyncSQLTail(t, callbacks=[callback], queue_size=2)
+        run = asyncio.ensure_future(tail.run(timeout=RUN_TIME))
+        await asyncio.sleep(0.1)
+        insert(*[f"m{i}" for i in range(4, 14)])
+        await asyncio.sleep(0.3)
+        # the rows are read, but with the callback held up the poller waits on the full queue
+        assert t.last_id == 13
+        assert received == [] and t.checkpoint.last_id is None
+        polls = t.stats.snapshot()['polls']
+        await asyncio.sleep(0.3)
+        assert t.stats.snapshot()['polls'] == polls
+        gate.set()
+        await asyncio.wait_for(run, RUN_TIME + 5)
+
+    start = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - start >= RUN_TIME
+    assert received == [f"m{i}" for i in range(4, 14)]
+    assert t.checkpoint.last_id == 13
+
+@pytest.mark.parametrize('tz', ['UTC', 'US/Eastern', 'Australia/Lord_Howe', 'Asia/Kathmandu'])
+def test_fmt_datetime(tz):
+    import arrow
+    field = sqltail.monitor.Field('timestamp', tz=tz)
+    fmt = field.compile()
+    start = datetime.datetime(2021, 3, 14, 0, 0, 0)
+    for minutes in range(0, 60 * 24 * 240, 53):
+        dt = start + datetime.timedelta(minutes=minutes, microseconds=minutes % 3)
+        assert fmt(dt) == arrow.get(dt).to(tz).isoformat(' ')[:24] == field.fmt(dt)
+    aware = arrow.get(start).to('Europe/Paris').datetime
+    assert fmt(aware) == field.fmt(aware)
+
+@pytest.mark.parametrize('options', [{}, {'truncate': 3}, {'left_pad': 6}, {'left_pad': 6, 'truncate': 4}, {'right_pad': 6}, {'right_pad': 6, 'truncate': 4}])
+def test_fmt_str(options):
+    field = sqltail.monitor.Field('message', **options)
+    fmt = field.compile()
+    for value in ['', 'abc', 'abcdefghij', 42, None]:
+        assert fmt(value) == field.fmt(value)
+
+def test_field_where_clause():
+    field = sqltail.monitor.Field('level', where_clause="{name} IN ('WARNING', 'ERROR')")
+    assert field.sql_where() == "level IN ('WARNING', 'ERROR')"
+    assert field.template()['where_clause'] == "{name} IN ('WARNING', 'ERROR')"
+    assert sqltail.monitor.Field('level', where_clause='level > 2').sql_where() == 'level > 2'
+
+def test_compile_formatter():
+    from sqltail.formatter import compile_formatter
+    funcs = [str, lambda v: v.upper()]
+    assert compile_formatter(funcs, ' ', offset=1)((7, 1, 'info')) == '1 INFO'
+    assert compile_formatter(funcs, '|', keys=['id', 'level'])({'_id': 7, 'id': 1, 'level': 'info'}) == '1|INFO'
+    assert compile_formatter(funcs[:1], ' ')((3,)) == '3'
+
+def test_record_class():
+    from sqltail.db import record_class
+    Record = record_class(('_id', 'level', 'message'))
+    row = Record((7, 'INFO', 'hello'))
+    assert row == (7, 'INFO', 'hello')
+    assert (row._id, row.level, row.message) == (7, 'INFO', 'hello')
+    assert record_class(('_id', 'level', 'message')) is Record
+    with pytest.raises(AttributeError):
+        row.level = 'ERROR'
+    with pytest.raises(AttributeError):
+        row.__dict__
+
+def test_scheduler():
+    from sqltail.scheduler import make_scheduler
+    s = make_scheduler('backoff', min_interval=0.1, max_interval=1, backoff=2)
+    assert [s.next_wait(0) for _ in range(5)] == [0.2, 0.4, 0.8, 1, 1]
+    assert s.next_wait(3) == 0
+    assert s.next_wait(0) == 0.2
+    assert s.stats()['empty_polls'] == 6
+
+    s = make_scheduler('adaptive', min_interval=0.1, max_interval=1, jitter=0.5)
+    assert s.next_wait(100, full=True) == 0
+    for _ in range(20):
+        wait = s.next_wait(0)
+        assert 0 <= wait <= 1.5
+    assert s.stats()['scheduler'] == 'adaptive'
+    with pytest.raises(ValueError):
+        make_scheduler('fixed')
+
+def test_run_waits(sqlite_log):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], batch_size=2, scheduler='adaptive', min_interval=0.05, interval=0.2)
+    events = []
+    poll, wait = t.poll, db.wait
+
+    def record_poll():
+        count = poll()
+        events.append(('poll', count))
+        return count
+
+    def record_wait(timeout):
+        events.append(('wait', timeout))
+        if len(events) == 2:
+            insert('four', 'five', 'six')
+        return wait(timeout)
+
+    t.poll, db.wait = record_poll, record_wait
+    t.run(timeout=0.3)
+    # a full batch is read again at once, a partial one waits for the scheduler
+    assert [e[1] if e[0] == 'poll' else 'wait' for e in events[:5]] == [0, 'wait', 2, 1, 'wait']
+    assert events[4][1] >= 0.05
+
+def test_run_interrupted(sqlite_log, tmp_path):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    checkpoint = tmp_path / 'checkpoint.json'
+    lines = []
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[lines.append], checkpoint=checkpoint, checkpoint_interval=60)
+    poll = t.poll
+
+    def interrupted():
+        if lines:
+            raise KeyboardInterrupt
+        insert('four', 'five')
+        return poll()
+
+    t.poll = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        t.run()
+    assert lines == ['four', 'five']
+    assert not t.cursors
+    assert sqltail.Checkpoint(checkpoint, t.checkpoint.key).load() == 5
+
+def test_stats_reporter_polling(sqlite_log, tmp_path):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[])
+    t.start()
+    report = tmp_path / 'stats.jsonl'
+    reporter = sqltail.StatsReporter(t, str(report), interval=0.001).start()
+    for i in range(2000):
+        if i % 100 == 0:
+            insert(f"m{i}")
+        t.poll()
+        # stages and counters first seen while the reporter reads them
+        t.stats.observe(f"stage{i}", 0.001)
+        t.stats.count(f"counter{i}")
+    assert reporter.thread.is_alive()
+    reporter.stop()
+    stats = [json.loads(line) for line in report.read_text().splitlines()]
+    assert len(stats) > 1
+    assert stats[-1]['tail']['polls'] == 2000
+    assert stats[-1]['tail']['counter1999'] == 1
+
+def test_run_interrupted_batch(sqlite_log, tmp_path):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    checkpoint = tmp_path / 'checkpoint.json'
+    batches = []
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], batch_callbacks=[batches.append], flush_latency=60, checkpoint=checkpoint, checkpoint_interval=60)
+    output_row = t.output_row
+
+    def interrupted(row):
+        if row[0] == 6:
+            raise KeyboardInterrupt
+        output_row(row)
+
+    start = t.start
+
+    def started():
+        start()
+        insert('four', 'five', 'six')
+
+    t.output_row, t.start = interrupted, started
+    with pytest.raises(KeyboardInterrupt):
+        t.run(timeout=1)
+    # the partial batch is written and checkpointed on the way out
+    assert batches == [['four', 'five']]
+    assert sqltail.Checkpoint(checkpoint, t.checkpoint.key).load() == 5
+
+    def failing(batch):
+        raise BrokenPipeError
+
+    # a batch which cannot be written leaves the checkpoint at the last one that was
+    checkpoint = tmp_path / 'failing.json'
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], batch_callbacks=[failing], flush_latency=60, checkpoint=checkpoint, checkpoint_interval=60)
+    t.start()
+    assert t.poll() == 0 and t.cursors
+    t.checkpoint.update(4)
+    t.checkpoint.update(5)
+    t.output_row((6, 'six'))
+    with pytest.raises(BrokenPipeError):
+        t.stop()
+    assert not t.cursors
+    assert sqltail.Checkpoint(checkpoint, t.checkpoint.key).load() == 5
+
+def test_checkpoint_filtered(sqlite_log, tmp_path):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    checkpoint = tmp_path / 'checkpoint.json'
+    lines = []
+    t = sqltail.SQLTail(db, fields=['level', 'message'], callbacks=[lines.append], where="level == 'ERROR'", checkpoint=checkpoint)
+    t.start()
+    insert('four', level='ERROR')
+    insert('five', 'six')
+    assert t.poll() == 3
+    assert lines == ['ERROR four']
+    t.stop()
+    # the skipped rows are not read again after a restart
+    assert sqltail.Checkpoint(checkpoint, t.checkpoint.key).load() == 6
+
+def test_batch_writer():
+    import io
+    stream = io.StringIO()
+    writer = sqltail.BatchWriter(stream)
+    writer(['a', 'b'])
+    writer(['c'])
+    assert stream.getvalue() == 'a\nb\nc\n'
+
+def test_encoders():
+    import types
+    from sqltail.output import make_encoder
+    Field = sqltail.monitor.Field
+    tail = types.SimpleNamespace(
+        table='log',
+        delimiter=' ',
+        fields={name: Field(name, tz='US/Eastern') for name in ['id', 'timestamp', 'message']},
+        format_row=lambda row: ' '.join(map(str, row[1:])),
+    )
+    row = (5, 5, datetime.datetime(2021, 7, 1, 12, 0, 0), 'hello, "world"')
+
+    record = json.loads(make_encoder('ndjson', tail, tag=True).encode(row))
+    assert record == {'_table': 'log', 'id': 5, 'timestamp': '2021-07-01T08:00:00-04:00', 'message': 'hello, "world"'}
+
+    encoder = make_encoder('csv', tail, events=True)
+    assert encoder.encode(row).split('\n') == ['_event,id,timestamp,message', 'insert,5,2021-07-01T08:00:00-04:00,"hello, ""world"""']
+    assert encoder.encode(row, 'delete').startswith('delete,5,')
+
+    assert make_encoder('text', tail, tag=True).encode(row, 'update') == 'log update 5 2021-07-01 12:00:00 hello, "world"'
+    with pytest.raises(ValueError):
+        make_encoder('xml', tail)
+
+def test_stats():
+    stats = sqltail.Stats()
+    for ms in [1, 2, 3, 4, 100]:
+        stats.observe('poll', ms / 1000)
+    stats.count('polls', 5)
+    stats.count('empty_polls', 4)
+    stats.count('rows', 10)
+    snapshot = stats.snapshot()
+    assert snapshot['empty_poll_ratio'] == 0.8
+    poll = snapshot['stages']['poll']
+    assert poll['count'] == 5
+    assert 0.002 <= poll['p50'] <= 0.0041
+    assert poll['p99'] == poll['max'] == 0.1
+
+def test_metrics():
+    import types
+    import urllib.request
+    stats = sqltail.Stats()
+    stats.count('rows', 3)
+    stats.observe('poll', 0.002)
+    tail = types.SimpleNamespace(
+        table='log',
+        db=types.SimpleNamespace(host='localhost', database='app_log'),
+        get_stats=lambda: dict(last_id=10, probe=dict(newest_id=15), tail=stats.snapshot(), db={'reconnects': 2}),
+    )
+    text = sqltail.render_metrics([tail])
+    labels = '{host="localhost",database="app_log",table="log"}'
+    assert f"sqltail_lag_rows{labels} 5" in text
+    assert f"sqltail_rows_total{labels} 3" in text
+    assert f"sqltail_reconnects_total{labels} 2" in text
+    assert '# TYPE sqltail_rows_total counter' in text
+    assert 'sqltail_poll_latency_seconds_count' in text
+    assert sqltail.render_metrics([tail], openmetrics=True).endswith('# EOF\n')
+
+    server = sqltail.MetricsServer([tail], port=0).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert f"sqltail_lag_rows{labels} 5" in response.read().decode()
+    finally:
+        server.stop()
+
+def test_metrics_polling(sqlite_log):
+    import threading
+    import urllib.request
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[])
+    t.start()
+    server = sqltail.MetricsServer([t], port=0).start()
+    done = threading.Event()
+    scrapes = []
+
+    def scrape():
+        while not done.is_set():
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                scrapes.append((response.status, response.read().decode()))
+
+    thread = threading.Thread(target=scrape)
+    thread.start()
+    try:
+        for i in range(2000):
+            if i % 100 == 0:
+                insert(f"m{i}")
+            t.poll()
+            t.stats.observe(f"stage{i}", 0.001)
+    finally:
+        done.set()
+        thread.join()
+        server.stop()
+    assert scrapes and all(status == 200 and 'sqltail_polls_total' in text for status, text in scrapes)
+
+@pytest.fixture
+def sqlite_log(tmp_path):
+    """a sqlite database file with a three row log table, and a function inserting more rows into it"""
+    import sqlite3
+    path = tmp_path / 'app_log.db'
+    cxn = sqlite3.connect(str(path), isolation_level=None)
+    cxn.execute('CREATE TABLE log (id INTEGER PRIMARY KEY, timestamp DATETIME, level TEXT, message TEXT);')
+
+    def insert(*messages, level='INFO'):
+        with cxn:
+            cxn.executemany('INSERT INTO log (timestamp, level, message) VALUES (?, ?, ?);', [('2021-06-01 12:00:00.250000', level, m) for m in messages])
+
+    insert('one', 'two', 'three')
+    yield str(path), insert
+    cxn.close()
+
+def test_sqlite(sqlite_log):
+    path, insert = sqlite_log
+    db = sqltail.make_database('sqlite', database=path)
+    lines = []
+    t = sqltail.SQLTail(db, fields=['timestamp', 'level', 'message'], callbacks=[lines.append], probe='max_id')
+    assert [c.Field for c in t.columns] == ['id', 'timestamp', 'level', 'message']
+    t.start()
+    assert t.last_id == 3
+    assert t.poll() == 0
+    insert('four')
+    insert('five', level='ERROR')
+    assert t.poll() == 2
+    assert lines == ['2021-06-01 12:00:00.2500 INFO four', '2021-06-01 12:00:00.2500 ERROR five']
+    # the first wait sees the inserts already polled
+    db.wait(0)
+    assert db.wait(0) is False
+    insert('six')
+    assert db.wait(1) is True
+    t.stop()
+
+def test_sqlite_filters(sqlite_log):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    lines = []
+    fields = [{'name': 'level', 'where_clause': "{name} = 'ERROR'"}, {'name': 'message'}]
+    t = sqltail.SQLTail(db, fields=fields, callbacks=[lines.append])
+    t.start()
+    insert('four')
+    insert('five', level='ERROR')
+    assert t.poll() == 1
+    assert lines == ['ERROR five']
+    # the filters are parenthesized, so the id range still applies to an OR
+    where = sqltail.SQLTail(db, filters=["message LIKE '%e' OR level = 'ERROR'"]).sql_where('id > ?')
+    assert db.full_scans(f"SELECT id FROM log {where};", (3,)) == []
+    assert db.full_scans("SELECT id FROM log WHERE message LIKE '%e' OR level = 'ERROR';") == ['SCAN log']
+    with pytest.raises(ValueError):
+        sqltail.SQLTail(db, filters=['bogus = 1'])
+    with pytest.raises(sqltail.DatabaseNotFound):
+        sqltail.SQLiteDatabase(database=path + '.missing')
+
+def test_catchup(sqlite_log):
+    path, insert = sqlite_log
+    insert(*[f"m{i}" for i in range(4, 1001)])
+    db = sqltail.SQLiteDatabase(database=path)
+    lines = []
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[lines.append], catchup_workers=3, catchup_chunk=64)
+    t.start()
+    t.last_id = 10
+    assert t.catch_up() == 990
+    assert lines == [f"m{i}" for i in range(11, 1001)]
+    assert t.last_id == 1000
+    # a backlog within one chunk is left to the live loop
+    insert('m1001')
+    assert t.catch_up() == 0
+    assert t.poll() == 1
+
+@pytest.mark.parametrize('output_format', ['text', 'csv'])
+def test_pipeline(sqlite_log, output_format):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    batches = []
+    t = sqltail.SQLTail(db, fields=['level', 'message'], callbacks=[], batch_callbacks=[batches.append], output_format=output_format)
+    pipeline = sqltail.Pipeline(t, processes=2, chunk_size=7).start()
+    insert(*[f"m{i}" for i in range(4, 101)])
+    assert pipeline.poll() == 97
+    pipeline.stop()
+    lines = [line for batch in batches for line in batch]
+    if output_format == 'csv':
+        assert lines[0] == 'level,message\nINFO,m4'
+        lines[0] = 'INFO,m4'
+    assert lines == [f"INFO{' ' if output_format == 'text' else ','}m{i}" for i in range(4, 101)]
+    assert len(batches) == 14
+
+def test_schema_cache(sqlite_log, tmp_path):
+    import sqlite3
+    path, insert = sqlite_log
+    cache = tmp_path / 'schema.json'
+    db = sqltail.SQLiteDatabase(database=path)
+    t = sqltail.SQLTail(db, schema_cache=cache)
+    assert list(t.fields) == ['id', 'timestamp', 'level', 'message']
+    db.get_columns = None
+    assert list(sqltail.SQLTail(db, schema_cache=cache).fields) == list(t.fields)
+    del db.get_columns
+    cxn = sqlite3.connect(path)
+    cxn.execute('ALTER TABLE log ADD COLUMN host TEXT;')
+    cxn.close()
+    assert list(sqltail.SQLTail(db, schema_cache=cache).fields) == ['id', 'timestamp', 'level', 'message', 'host']
+    assert [c['Field'] for c in sqltail.SchemaCache(cache).get(t.schema_key, db.schema_fingerprint('log'))][-1] == 'host'
+
+def test_server(sqlite_log, tmp_path):
+    import io
+    import threading
+    from sqltail.server import attach
+    path, insert = sqlite_log
+    address = str(tmp_path / 'sqltail.sock')
+    server = sqltail.TailServer(sqltail.SQLiteDatabase(database=path), ['log'], address, min_interval=0.01, interval=0.05)
+    thread = threading.Thread(target=server.run, kwargs=dict(timeout=10), daemon=True)
+    thread.start()
+    while not server.listener:
+        time.sleep(0.01)
+    requests = [
+        dict(fields=['level', 'message']),
+        dict(fields=['message'], match=dict(level='ERROR'), output_format='ndjson'),
+        dict(fields=['nonesuch']),
+        dict(fields=['message'], where="message ~ '^fi'"),
+    ]
+    streams = [io.BytesIO() for _ in requests]
+    errors = []
+
+    def client(request, stream):
+        try:
+            attach(address, request, stream, timeout=1)
+        except ValueError as exc:
+            errors.append(str(exc))
+
+    clients = [threading.Thread(target=client, args=args) for args in zip(requests, streams)]
+    for client_thread in clients:
+        client_thread.start()
+    while len(server.subscribers['log']) < 3:
+        time.sleep(0.01)
+    insert('four')
+    insert('five', level='ERROR')
+    for client_thread in clients:
+        client_thread.join()
+    server.running = False
+    thread.join()
+    assert streams[0].getvalue() == b'INFO four\nERROR five\n'
+    assert streams[1].getvalue() == b'{"message":"five"}\n'
+    assert errors == ['log has no field nonesuch']
+    assert streams[3].getvalue() == b'five\n'
+    assert server.tails[0].stats.snapshot()['polls'] > 0
+
+def test_server_slow_subscriber(sqlite_log, tmp_path, caplog):
+    import socket
+    import threading
+    path, insert = sqlite_log
+    address = str(tmp_path / 'sqltail.sock')
+    server = sqltail.TailServer(sqltail.SQLiteDatabase(database=path), ['log'], address, min_interval=0.01, interval=0.05)
+    server.send_timeout = 0.2
+    thread = threading.Thread(target=server.run, kwargs=dict(timeout=10), daemon=True)
+    thread.start()
+    while not server.listener:
+        time.sleep(0.01)
+
+    def subscribe(request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+        sock.sendall((json.dumps(request) + '\n').encode())
+        while not server.subscribers['log']:
+            time.sleep(0.01)
+        return sock, server.subscribers['log'][0]
+
+    def unsubscribed():
+        deadline = time.monotonic() + 5
+        while server.subscribers['log'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not server.subscribers['log']
+
+    # a client which never reads is dropped once a write blocks
+    sock, subscriber = subscribe(dict(fields=['message']))
+    insert(*['x' * 1000] * 5000)
+    assert unsubscribed()
+    assert 'stopped reading; disconnecting' in caplog.text
+    sock.close()
+
+    sock, subscriber = subscribe(dict(fields=['message']))
+
+    def broken(rows):
+        raise TypeError('cannot encode')
+
+    subscriber.encode = broken
+    insert('four')
+    assert unsubscribed()
+    assert 'failed to encode rows: cannot encode' in caplog.text
+    sock.close()
+    server.running = False
+    thread.join()
+
+def test_filter_expressions():
+    from sqltail.filters import compile_filter, FilterError
+    names = ['timestamp', 'level', 'message', 'code']
+    rows = [
+        (1, datetime.datetime(2021, 6, 1, 12), 'INFO', 'started', 0),
+        (2, datetime.datetime(2021, 6, 1, 13), 'ERROR', 'connect timeout', 504),
+        (3, datetime.datetime(2021, 6, 2, 9), 'WARNING', 'Slow Query', None),
+        (4, datetime.datetime(2021, 6, 2, 10), 'ERROR', 'refused', '111'),
+    ]
+
+    def ids(expression):
+        predicate = compile_filter(expression, names)
+        return [row[0] for row in rows if predicate(row)]
+
+    assert ids("level == 'ERROR'") == [2, 4]
+    assert ids("level = 'ERROR' and message ~ 'time'") == [2]
+    assert ids("message ~ 'timeout|refused'") == [2, 4]
+    assert ids("message !~ 'e'") == []
+    assert ids("level in ('WARNING', 'ERROR') and not message like '%timeout'") == [3, 4]
+    assert ids("message LIKE 'slow%'") == [3]
+    assert ids("level not in ('INFO')") == [2, 3, 4]
+    assert ids("code >= 111") == [2, 4]
+    assert ids("code is null or code == 0") == [1, 3]
+    assert ids("code is not null and (level <> 'ERROR' or code < 200)") == [1, 4]
+    assert ids("timestamp >= '2021-06-02'") == [3, 4]
+    assert ids('message == "connect timeout"') == [2]
+    # a null code matches neither a comparison nor its negation, as in SQL
+    assert ids("not code == 0") == [2, 4]
+    assert ids("not (code == 0 or level == 'INFO')") == [2, 4]
+    assert ids("not (code == 0 and level == 'WARNING')") == [1, 2, 4]
+    assert ids("not (code is null or code < 200)") == [2]
+    assert ids("not not code == 0") == [1]
+    for expression, error in [
+        ("level == ", "expected literal but found the end"),
+        ("level === 'x'", "expected literal but found '='"),
+        ("(level == 'x'", "expected ) but found the end"),
+        ("level 'x'", "expected comparison but found 'x'"),
+        ("host == 'web1'", "unknown field host"),
+        ("message ~ '('", "invalid regular expression"),
+        ("level == 'x' @", "unexpected '@'"),
+    ]:
+        with pytest.raises(FilterError, match=re.escape(error)):
+            compile_filter(expression, names)
+
+def test_sqlite_where(sqlite_log):
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path)
+    lines = []
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[lines.append], where="level == 'ERROR' or message like '%x'")
+    assert t.sql_fields == 'message,level'
+    t.start()
+    insert('four', 'six')
+    insert('five', level='ERROR')
+    assert t.poll() == 3
+    assert lines == ['six', 'five']
+    assert t.last_id == 6
+    assert t.stats.snapshot()['filtered'] == 1
+    with pytest.raises(ValueError, match='no column host'):
+        sqltail.SQLTail(db, where="host == 'web1'")
+
+def test_time_window(tmp_path):
+    import sqlite3
+    from sqltail.window import parse_time
+    path = str(tmp_path / 'window.db')
+    cxn = sqlite3.connect(path, isolation_level=None)
+    cxn.execute('CREATE TABLE log (id INTEGER PRIMARY KEY, created DATETIME, message TEXT);')
+    start = datetime.datetime(2021, 6, 1, 12)
+    cxn.executemany('INSERT INTO log (id, created, message) VALUES (?, ?, ?);',
+                    [(i, str(start + datetime.timedelta(minutes=i)), f"m{i}") for i in range(1, 1001) if i % 7])
+    db = sqltail.SQLiteDatabase(database=path)
+    lines = []
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[lines.append], batch_size=50, since='2021-06-01 14:00', until='2021-06-01 15:00:30')
+    assert t.window.column == 'created'
+    t.run()
+    assert lines == [f"m{i}" for i in range(120, 181) if i % 7]
+    assert t.window.queries <= 2 * 11
+    assert t.last_id == 180
+    # with catch-up, and without until: the window hands off to the live tail
+    lines.clear()
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[lines.append], since=datetime.datetime(2021, 6, 1, 12, 57), catchup_workers=2, catchup_chunk=100)
+    t.start()
+    assert t.catch_up() == len([i for i in range(57, 1001) if i % 7])
+    cxn.execute("INSERT INTO log (created, message) VALUES ('2021-06-02 06:00:00', 'live');")
+    assert t.poll() == 1
+    assert lines[0] == 'm57' and lines[-1] == 'live'
+    assert t.running
+    with pytest.raises(ValueError, match='no column updated'):
+        sqltail.SQLTail(db, since='1h', time_column='updated')
+    # strings are taken in tz, durations and datetimes are already UTC
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], tz='US/Eastern', since='2021-06-01 10:00', until=datetime.datetime(2021, 6, 1, 15))
+    assert (t.window.since, t.window.until) == (datetime.datetime(2021, 6, 1, 14), datetime.datetime(2021, 6, 1, 15))
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], tz='US/Eastern', since='15m')
+    assert abs(t.window.since - now + datetime.timedelta(minutes=15)) < datetime.timedelta(seconds=5)
+    assert parse_time('2021-06-01T08:00:00-04:00') == datetime.datetime(2021, 6, 1, 12)
+    assert parse_time('2021-06-01 08:00', 'US/Eastern') == datetime.datetime(2021, 6, 1, 12)
+    assert abs(parse_time('90s') - datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(seconds=90)) < datetime.timedelta(seconds=5)
+    with pytest.raises(ValueError, match='expected a duration'):
+        parse_time('yesterday')
+    cxn.close()
+
+def test_backoff():
+    from sqltail.db.connection import Backoff
+    backoff = Backoff(initial=1, maximum=5, multiplier=2, jitter=0.5)
+    delays = [backoff.next() for _ in range(5)]
+    for delay, full in zip(delays, [1, 2, 4, 5, 5]):
+        assert full * 0.5 <= delay <= full
+    backoff.reset()
+    assert backoff.next() <= 1
+
+def test_host_health():
+    from sqltail.db.connection import HostHealth, parse_hosts
+    servers = parse_hosts('db1, db2:3307,db3', '3306')
+    assert servers == [('db1', '3306'), ('db2', '3307'), ('db3', '3306')]
+    assert parse_hosts(None, None) == []
+    health = HostHealth(cooldown=60)
+    assert health.order(servers) == servers
+    health.failed(servers[0])
+    health.succeeded(servers[2])
+    assert health.order(servers) == [servers[2], servers[1], servers[0]]
+    health.failed(servers[2])
+    assert health.order(servers) == [servers[1], servers[0], servers[2]]
+    health.cooldown = 0
+    assert health.order(servers) == servers
+
+def test_failover():
+    from sqltail.db import connection
+    pytest.importorskip('mysql.connector')
+    with pytest.raises(sqltail.DatabaseConnectionFailed, match='127.0.0.2:1'):
+        sqltail.Database(host='127.0.0.1:1,127.0.0.2:1', port='3306', user='user', password='password', database='log')
+    assert connection.health.order([('127.0.0.2', '1'), ('127.0.0.3', '1')])[0] == ('127.0.0.3', '1')
+
+def test_recover(sqlite_log):
+    import sqlite3
+    path, insert = sqlite_log
+    db = sqltail.SQLiteDatabase(database=path, retry_timeout=5)
+    lines = []
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[lines.append])
+    t.start()
+    insert('four', 'five', 'six')
+    rows = t.get_new_rows
+
+    def dropped(last_id):
+        for i, row in enumerate(rows(last_id)):
+            if i == 2:
+                raise sqlite3.InterfaceError('connection lost')
+            yield row
+
+    failures = [sqltail.DatabaseConnectionFailed('down')] * 2
+    connect = db.connect
+
+    def flaky(database=None):
+        if failures:
+            raise failures.pop()
+        return connect(database)
+
+    t.get_new_rows = dropped
+    db.connect = flaky
+    generation = db.generation
+    connects = db.stats.snapshot()['stages']['connect']['count']
+    assert t.poll() == 2
+    assert db.generation == generation + 1
+    assert db.stats.snapshot()['retries'] == 2
+    # the reconnect is timed once, by the connect which succeeded
+    assert db.stats.snapshot()['stages']['connect']['count'] == connects + 1
+    del t.get_new_rows
+    assert t.poll() == 1
+    assert lines == ['four', 'five', 'six']
+    failures[:] = [sqltail.DatabaseConnectionFailed('down')] * 10
+    db.retry_timeout = 0
+    with pytest.raises(sqltail.DatabaseConnectionFailed):
+        db.recover()
+
+def test_cli(sqlite_log):
+    from click.testing import CliRunner
+    from sqltail.cli import sqltail as cli
+    path, insert = sqlite_log
+    args = ['--backend', 'sqlite', '--database', path, '--suffix', '', '-c', 'level,message', '--since', '2021-06-01']
+    result = CliRunner().invoke(cli, args + ['--timeout', '0.3', '--interval', '0.05', '--min-interval', '0.01'])
+    assert result.exit_code == 0, result.output
+    assert result.output == 'INFO one\nINFO two\nINFO three\n'
+    result = CliRunner().invoke(cli, args + ['--until', '2021-06-02', '--where', "message ~ 't'", '-o', 'csv'])
+    assert result.exit_code == 0, result.output
+    assert result.output == 'level,message\nINFO two\nINFO three\n'.replace(' ', ',')
+    # --since and --until are in --timezone; the rows are stamped 12:00 UTC
+    window = ['--timezone', 'US/Eastern', '--since', '2021-06-01 08:00', '--until', '2021-06-01 08:01']
+    result = CliRunner().invoke(cli, args[:-2] + window)
+    assert result.exit_code == 0, result.output
+    assert result.output == 'INFO one\nINFO two\nINFO three\n'
+    result = CliRunner().invoke(cli, args + ['--where', 'level =='])
+    assert result.exit_code == 2
+    assert 'Invalid value for --where' in result.output
+
+def test_mysql_prepared_values():
+    pytest.importorskip('mysql.connector')
+    import decimal
+    from mysql.connector.constants import FieldType, FieldFlag
+    from mysql.connector.conversion import MySQLConverter
+    from sqltail.db.mysql import PreparedCursor
+
+    class BinaryCursor():
+        # the values mysql-connector 2.x's binary protocol produces
+        description = [
+            ('id', FieldType.LONGLONG, None, None, None, None, 0, 0),
+            ('level', FieldType.VAR_STRING, None, None, None, None, 1, 0),
+            ('message', FieldType.BLOB, None, None, None, None, 1, 0),
+            ('amount', FieldType.NEWDECIMAL, None, None, None, None, 1, 0),
+            ('digest', FieldType.BLOB, None, None, None, None, 1, FieldFlag.BINARY),
+        ]
+        rows = [(1, b'ERROR', b'caf\xc3\xa9', b'1.50', b'\x00\xff'), (2, None, None, None, None)]
+
+        def fetchone(self):
+            return self.rows.pop(0) if self.rows else None
+
+        def fetchall(self):
+            rows, self.rows = self.rows, []
+            return rows
+
+    cursor = PreparedCursor(BinaryCursor(), MySQLConverter('utf8'))
+    assert cursor.fetchone() == (1, 'ERROR', 'café', decimal.Decimal('1.50'), b'\x00\xff')
+    assert cursor.fetchall() == [(2, None, None, None, None)]
+    assert cursor.fetchone() is None
+    assert cursor.description[1][0] == 'level'
+
+def test_metrics_backlog(sqlite_log):
+    path, insert = sqlite_log
+    insert(*[f"m{i}" for i in range(4, 11)])
+    t = sqltail.SQLTail(sqltail.SQLiteDatabase(database=path), callbacks=[], batch_size=4)
+    t.start()
+    # resumed 10 rows behind, with no probe
+    t.last_id = t.newest_id = t.probe_id = 0
+    labels = '{host="None",database="' + path + '",table="log"}'
+    assert t.poll() == 4
+    assert t.get_stats()['probe']['newest_id'] == 10
+    assert f"sqltail_lag_rows{labels} 6" in sqltail.render_metrics([t])
+    assert t.poll() == 4
+    assert t.poll() == 2
+    assert f"sqltail_lag_rows{labels} 0" in sqltail.render_metrics([t])
+    t.newest_id = 5
+    assert t.get_stats()['probe']['newest_id'] == 10
+
+def test_auto_increment_uncommitted(sqlite_log):
+    path, insert = sqlite_log
+    lines = []
+    t = sqltail.SQLTail(sqltail.SQLiteDatabase(database=path), fields=['message'], callbacks=[lines.append])
+    t.start()
+    # AUTO_INCREMENT - 1 as MySQL reports it while the insert of id 5 is uncommitted
+    t.probe = 'auto_increment'
+    t.get_newest_id = lambda: 5
+    insert('four')
+    assert t.poll() == 1
+    assert t.probe_id == 4
+    insert('five')
+    assert t.poll() == 1
+    assert t.probe_id == 5
+    assert t.poll() == 0
+    assert t.probes_skipped == 1
+    assert lines == ['four', 'five']
+
+def test_async_time_window(sqlite_log):
+    import asyncio
+    path, insert = sqlite_log
+    insert(*[f"m{i}" for i in range(4, 14)])
+    db = sqltail.SQLiteDatabase(database=path)
+    t = sqltail.SQLTail(db, fields=['message'], callbacks=[], batch_size=5, since='2021-06-01', until='2021-06-02', catchup_workers=2, catchup_chunk=4)
+    received = []
+
+    async def callback(msg):
+        received.append(msg)
+
+    # ends with the time window, without a timeout
+    tail = sqltail.AsyncSQLTail(t, callbacks=[callback], queue_size=2)
+    asyncio.run(asyncio.wait_for(tail.run(), 5))
+    assert received == ['one', 'two', 'three'] + [f"m{i}" for i in range(4, 14)]
+    assert t.last_id == 13
+
+def test_sqlite_multitail(sqlite_log):
+    import sqlite3
+    path, insert = sqlite_log
+    insert('four', level='ERROR')
+    cxn = sqlite3.connect(path, isolation_level=None)
+    cxn.execute('CREATE TABLE events (id INTEGER PRIMARY KEY, timestamp DATETIME, kind TEXT);')
+    cxn.executemany('INSERT INTO events (timestamp, kind) VALUES (?, ?);', [('2021-06-01 12:00:00.500000', k) for k in ('login', 'logout', 'login')])
+    cxn.close()
+    db = sqltail.SQLiteDatabase(database=path)
+    lines = []
+    tables = {'log': {'fields': ['level', 'message'], 'filters': ["level = 'ERROR'"]}, 'events': {'fields': ['kind'], 'where': "kind == 'login'"}}
+    t = sqltail.MultiTail(db, tables, callbacks=[lines.append], since='2021-06-01', until='2021-06-02')
+    # one worker polls both tables on the same connection
+    assert [tail.db for tail in t.tails] == [db, db]
+    t.run(timeout=5)
+    assert sorted(lines) == ['events login', 'events login', 'log ERROR four']
+    assert [tail.last_id for tail in t.tails] == [4, 3]
+
+def test_binlog_handle_event(sqlite_log, tmp_path, caplog):
+    path, insert = sqlite_log
+
+    class WriteRowsEvent():
+        table = 'log'
+
+        def __init__(self, *rows):
+            self.rows = [dict(values=values) for values in rows]
+
+    class UpdateRowsEvent(WriteRowsEvent):
+        def __init__(self, *rows):
+            self.rows = [dict(before_values={}, after_values=values) for values in rows]
+
+    db = sqltail.SQLiteDatabase(database=path)
+    lines = []
+    fields = [{'name': 'level', 'where_clause': "{name} != 'DEBUG'"}, {'name': 'message'}]
+    t = sqltail.SQLTail(db, fields=fields, callbacks=[lines.append], where="message != 'skip'", checkpoint=tmp_path / 'checkpoint.json')
+    binlog = sqltail.BinlogTail([t], events=('insert', 'update'))
+    assert 'SQL filters are not applied in binlog mode' in caplog.text
+    row = dict(id=4, timestamp='2021-06-01 12:00:00', level='INFO', message='four')
+    binlog.handle_event(t, WriteRowsEvent(row, dict(row, id=5, message='skip'), dict(row, id=6, message='six')))
+    assert lines == ['INFO four', 'INFO six']
+    assert t.checkpoint.last_id == 6
+    # an update of an old row is output, but does not move the checkpoint back
+    binlog.handle_event(t, UpdateRowsEvent(dict(row, level='ERROR')))
+    assert lines[2:] == ['update ERROR four']
+    assert t.checkpoint.last_id == 6
+    t.stop()